@@ -0,0 +1,236 @@
+import collections
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from incidents import INCIDENT_ESCALATED, INCIDENT_EVENT_LABELS, INCIDENT_OPENED, INCIDENT_RESOLVED
+
+DISCORD_MAX_EMBEDS = 10
+DISCORD_USERNAME = "Sistema de Monitoreo de Sensores"
+DISCORD_AVATAR_URL = "https://i.imgur.com/4S0t20e.png"
+
+# Color del embed según el evento del incidente: rojo al abrir, naranja al escalar, verde al resolver.
+INCIDENT_COLORS = {
+    INCIDENT_OPENED: 15548997,
+    INCIDENT_ESCALATED: 15105570,
+    INCIDENT_RESOLVED: 5763719,
+}
+DIGEST_MAX_LINES = 20
+
+
+def _format_time(timestamp, tz):
+    return datetime.fromtimestamp(timestamp, timezone.utc).astimezone(tz).strftime('%Y-%m-%d %H:%M:%S %Z%z')
+
+
+def _format_duration(seconds):
+    minutos, segundos = divmod(int(round(seconds)), 60)
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas} h {minutos:02d} min" if horas else f"{minutos} min {segundos:02d} s"
+
+
+def build_incident_embed(event, sensor_id, anomaly_type, action_suggestion_text, tz=timezone.utc):
+    # event: diccionario de IncidentTracker.update (apertura, escalamiento o resolución).
+    kind = event['event']
+    numero = event['incident_id']
+    if kind == INCIDENT_OPENED:
+        title = f"🚨 ALERTA: Anomalía Detectada en {sensor_id}"
+        description = (f"Se abrió el incidente **#{numero}** en el sensor **{sensor_id}**.\n\n"
+                       f"**Sugerencia de Acción:** {action_suggestion_text}")
+    elif kind == INCIDENT_ESCALATED:
+        title = f"⚠️ ESCALAMIENTO: Incidente #{numero} en {sensor_id} (nivel {event['level']})"
+        description = (f"El incidente **#{numero}** acumula **{event['count']}** lecturas anómalas.\n\n"
+                       f"**Sugerencia de Acción:** {action_suggestion_text}")
+    else:
+        title = f"✅ RESUELTO: Incidente #{numero} en {sensor_id}"
+        description = f"El sensor **{sensor_id}** no registra lecturas anómalas desde {_format_time(event['last_seen'], tz)}."
+    return {
+        "title": title,
+        "description": description,
+        "color": INCIDENT_COLORS[kind],
+        "fields": [
+            {"name": "Sensor ID", "value": sensor_id, "inline": True},
+            {"name": "Tipo de Anomalía", "value": anomaly_type, "inline": True},
+            {"name": "Valor del Sensor", "value": f"{event['last_value']:.2f}°C", "inline": True},
+            {"name": "Lecturas Anómalas", "value": str(event['count']), "inline": True},
+            {"name": "Rango", "value": f"{event['min_value']:.2f} – {event['max_value']:.2f}°C", "inline": True},
+            {"name": "Duración", "value": _format_duration(event['last_seen'] - event['started_at']), "inline": True},
+            {"name": "Inicio del Incidente", "value": _format_time(event['started_at'], tz), "inline": False},
+        ],
+        "footer": {
+            "text": "Revisa el sistema de monitoreo en Streamlit Cloud"
+        }
+    }
+
+
+def build_digest_embed(kind, rows, tz=timezone.utc):
+    # Un solo mensaje para muchos incidentes del mismo evento en un lote. rows: tuplas
+    # (sensor_id, tipo de anomalía, evento), las de más lecturas primero.
+    rows = sorted(rows, key=lambda fila: -fila[2]['count'])
+    por_tipo = collections.Counter(tipo for _, tipo, _ in rows)
+    lineas = [f"**{sensor_id}** · {tipo} · #{evento['incident_id']} · {evento['count']} lecturas · "
+              f"{evento['min_value']:.1f}–{evento['max_value']:.1f}°C"
+              for sensor_id, tipo, evento in rows[:DIGEST_MAX_LINES]]
+    if len(rows) > DIGEST_MAX_LINES:
+        lineas.append(f"… y {len(rows) - DIGEST_MAX_LINES} más")
+    return {
+        "title": f"📋 RESUMEN DE FLOTA: {len(rows)} incidentes {INCIDENT_EVENT_LABELS[kind].lower()}s",
+        "description": "\n".join(lineas),
+        "color": INCIDENT_COLORS[kind],
+        "fields": [
+            {"name": tipo, "value": str(total), "inline": True}
+            for tipo, total in por_tipo.most_common(DISCORD_MAX_EMBEDS)
+        ] + [
+            {"name": "Hora", "value": _format_time(max(evento['at'] for _, _, evento in rows), tz), "inline": False}
+        ],
+        "footer": {
+            "text": "Revisa el sistema de monitoreo en Streamlit Cloud"
+        }
+    }
+
+
+class AlertDispatcher:
+    # Cola acotada drenada por un hilo en segundo plano: las alertas pendientes se
+    # agrupan en un solo POST (hasta 10 embeds por mensaje de Discord) usando una
+    # sesión HTTP keep-alive, respetando retry_after en respuestas 429.
+
+    def __init__(self, webhook_url, max_queue=1000, max_batch=DISCORD_MAX_EMBEDS, timeout=5.0,
+                 max_retries=5, backoff_base=0.5, backoff_max=30.0):
+        self.webhook_url = webhook_url
+        self.max_batch = max(1, min(int(max_batch), DISCORD_MAX_EMBEDS))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            'enqueued': 0,
+            'dropped': 0,
+            'sent_alerts': 0,
+            'sent_messages': 0,
+            'failed_alerts': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'last_latency_s': 0.0,
+            'max_latency_s': 0.0,
+            'total_latency_s': 0.0,
+            'last_error': "",
+        }
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="discord-alert-dispatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._session.close()
+
+    def submit(self, embed):
+        try:
+            self._queue.put_nowait((time.monotonic(), embed))
+        except queue.Full:
+            with self._lock:
+                self._metrics['dropped'] += 1
+            return False
+        with self._lock:
+            self._metrics['enqueued'] += 1
+        return True
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot['queue_depth'] = self._queue.qsize()
+        snapshot['avg_latency_s'] = snapshot['total_latency_s'] / snapshot['sent_alerts'] if snapshot['sent_alerts'] else 0.0
+        return snapshot
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=0.2)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        payload = {
+            "username": DISCORD_USERNAME,
+            "avatar_url": DISCORD_AVATAR_URL,
+            "embeds": [embed for _, embed in batch],
+        }
+        error = ""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self._metrics['retries'] += 1
+            try:
+                response = self._session.post(self.webhook_url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+                if self._stop.wait(self._backoff(attempt)):
+                    break
+                continue
+            if response.status_code == 429:
+                with self._lock:
+                    self._metrics['rate_limited'] += 1
+                error = "429 Too Many Requests"
+                if self._stop.wait(self._retry_after(response, attempt)):
+                    break
+                continue
+            if response.status_code >= 500:
+                error = f"{response.status_code} {response.reason}"
+                if self._stop.wait(self._backoff(attempt)):
+                    break
+                continue
+            if response.ok:
+                self._record_delivery(batch)
+                return
+            error = f"{response.status_code} {response.reason}"
+            break
+        with self._lock:
+            self._metrics['failed_alerts'] += len(batch)
+            self._metrics['last_error'] = error
+
+    def _record_delivery(self, batch):
+        now = time.monotonic()
+        latencies = [now - enqueued_at for enqueued_at, _ in batch]
+        with self._lock:
+            self._metrics['sent_messages'] += 1
+            self._metrics['sent_alerts'] += len(batch)
+            self._metrics['last_latency_s'] = latencies[-1]
+            self._metrics['max_latency_s'] = max(self._metrics['max_latency_s'], max(latencies))
+            self._metrics['total_latency_s'] += sum(latencies)
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt))
+
+    def _retry_after(self, response, attempt):
+        retry_after = None
+        try:
+            retry_after = float(response.json().get("retry_after"))
+        except (ValueError, TypeError, AttributeError):
+            pass
+        if retry_after is None:
+            try:
+                retry_after = float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                retry_after = self._backoff(attempt)
+        return min(self.backoff_max, max(0.0, retry_after))
@@ -1,108 +1,93 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-import time
-import requests
 import altair as alt
-from datetime import datetime, timezone
+import time
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
-MEXICO_CITY_TZ = ZoneInfo("America/Mexico_City")
-
-SENSOR_IDS = ["Sensor_001", "Sensor_002", "Sensor_003", "Sensor_004"] 
-
-def send_discord_alert(sensor_id, sensor_value, anomaly_type, action_suggestion_text):
-    DISCORD_WEBHOOK_URL = st.secrets.get("DISCORD_WEBHOOK_URL") 
+from alerts import AlertDispatcher
+from charting import decimate_indices
+from detectors import DetectorBank
+from engine import SensorEngine
+from features import SlidingWindowFeatures, window_features
+from ingest_server import IngestServer
+from history_store import (ANOMALY_TYPE_CODES, ANOMALY_TYPE_LABELS, HISTORY_DISPLAY_FORMATS, STATUS_ANOMALY, STATUS_LABELS,
+                           columns_to_dataframe)
+from incidents import INCIDENT_ESCALATED, INCIDENT_OPENED, INCIDENT_RESOLVED
+from metrics import MetricsRegistry, MetricsServer, null_timer
+from model_registry import ModelRegistry
+from rollups import ROLLUP_TIERS, RollupStore, rollups_to_dataframe
+from simulation import (LIVE_FAILURE_PROBABILITIES, LIVE_FAILURE_SCHEDULE, LIVE_RECOVERY_PROBABILITY, FleetSimulator,
+                        make_sensor_ids, make_training_series)
+from storage import StorageWriter, open_storage
+from training import ModelRetrainer
 
-    if not DISCORD_WEBHOOK_URL:
-        st.warning("🚨 ADVERTENCIA: La URL del Webhook de Discord no está configurada en los Streamlit Secrets.")
-        return
+MEXICO_CITY_TZ = ZoneInfo("America/Mexico_City")
 
-    current_utc_time = datetime.now(timezone.utc)
-    current_mexico_city_time = current_utc_time.astimezone(MEXICO_CITY_TZ)
-    formatted_datetime_for_discord = current_mexico_city_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')
-
-    message_content = {
-        "username": "Sistema de Monitoreo de Sensores",
-        "avatar_url": "https://i.imgur.com/4S0t20e.png", 
-        "embeds": [
-            {
-                "title": f"🚨 ALERTA: Anomalía Detectada en {sensor_id}",
-                "description": f"Se ha detectado una **ANOMALÍA** en el sensor **{sensor_id}**.\n\n"
-                               f"**Sugerencia de Acción:** {action_suggestion_text}",
-                "color": 15548997, 
-                "fields": [
-                    {"name": "Sensor ID", "value": sensor_id, "inline": True},
-                    {"name": "Tipo de Anomalía", "value": anomaly_type, "inline": True},
-                    {"name": "Valor del Sensor", "value": f"{sensor_value:.2f}°C", "inline": True},
-                    {"name": "Hora de Detección", "value": formatted_datetime_for_discord, "inline": False}
-                ],
-                "footer": {
-                    "text": "Revisa el sistema de monitoreo en Streamlit Cloud"
-                }
-            }
-        ]
-    }
+SENSOR_COUNT = 4
+SENSOR_IDS = make_sensor_ids(SENSOR_COUNT)
+SENSOR_INDEX = {sensor_id: idx for idx, sensor_id in enumerate(SENSOR_IDS)}
+# Fallos del simulador (calendario, probabilidad por tick de cada tipo y de recuperarse). Los
+# valores en vivo dejan lecturas normales para reentrenar; ver simulation.LIVE_*.
+SIMULATOR_FAILURE_SCHEDULE = LIVE_FAILURE_SCHEDULE
+SIMULATOR_FAILURE_PROBABILITIES = LIVE_FAILURE_PROBABILITIES
+SIMULATOR_RECOVERY_PROBABILITY = LIVE_RECOVERY_PROBABILITY
+
+HISTORY_CAPACITY = 50_000
+# Contaminación con la que arranca toda la flota (también los modelos cargados del registro).
+MODEL_CONTAMINATION = 0.03
+USE_COMPILED_SCORER = True
+STREAMING_DETECTORS = ("flatline", "rate_of_change")
+# Ventana (en lecturas) del modelo multivariable; None entrena y evalúa sobre el valor suelto.
+FEATURE_WINDOW = None
+FRAME_INTERVAL_SECONDS = 1.0
+STORAGE_BACKEND = "sqlite"
+INGEST_HOST = "127.0.0.1"
+INGEST_PORT = 9009
+STORAGE_PATH = "data/lecturas.db"
+CHART_MAX_POINTS_PER_SENSOR = 300
+# Tiers de agregados (segundos por bucket, buckets por sensor) para las ventanas largas del
+# gráfico; None las dibuja siempre desde lecturas crudas.
+CHART_ROLLUP_TIERS = ROLLUP_TIERS
+# Registro en disco de los modelos por sensor (versiones, fijar/revertir). None lo deshabilita.
+MODEL_REGISTRY_PATH = "data/modelos"
+# Reentrenamiento en segundo plano de un modelo por sensor con su propia ventana reciente
+# (arranca con el modelo compartido de datos sintéticos). RETRAIN_INTERVAL_SECONDS = None
+# lo deshabilita; RETRAIN_WORKERS = None usa un proceso por núcleo (a lo sumo uno por sensor).
+RETRAIN_INTERVAL_SECONDS = 300
+RETRAIN_WINDOW = 2000
+RETRAIN_MIN_SAMPLES = 200
+RETRAIN_WORKERS = None
+# El motor es uno por proceso: los controles de velocidad y sensibilidad lo cambian para
+# todas las sesiones. Con False las sesiones solo observan.
+ALLOW_VIEWER_CONTROLS = True
+# Instrumentación por etapa; con METRICS_ENABLED = False no se mide nada. METRICS_PORT = None
+# deja el panel del sidebar pero no abre el endpoint de Prometheus.
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+CHART_WINDOWS = {
+    "Últimas 30 lecturas": None,
+    "Últimos 5 minutos": 5 * 60,
+    "Última hora": 60 * 60,
+    "Últimas 6 horas": 6 * 60 * 60,
+    "Últimas 24 horas": 24 * 60 * 60,
+    "Últimos 7 días": 7 * 24 * 60 * 60,
+}
+TABLE_PAGE_SIZES = (25, 50, 100)
+TABLE_TIME_RANGES = {
+    "Todo el historial": None,
+    "Últimos 5 minutos": 5 * 60,
+    "Última hora": 60 * 60,
+    "Últimas 24 horas": 24 * 60 * 60,
+}
 
-    try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=message_content)
-        response.raise_for_status() 
-        st.success(f"Alerta de Discord enviada correctamente para {sensor_id} (Código: {response.status_code})")
-    except Exception as e:
-        st.error(f"Error al enviar alerta a Discord para {sensor_id}: {e}")
+@st.cache_resource
+def get_alert_dispatcher(webhook_url):
+    return AlertDispatcher(webhook_url).start()
 
 st.set_page_config(page_title="Precisa Temp Multi-Sensor", layout="wide") 
 
-np.random.seed(42)
-
-temperatura_normal_entrenamiento = 25 + 2 * np.random.randn(500)
-temperatura_normal_entrenamiento = np.clip(temperatura_normal_entrenamiento, 20, 30)
-
-temperatura_con_fallos_entrenamiento = np.copy(temperatura_normal_entrenamiento)
-temperatura_con_fallos_entrenamiento[50:55] = np.random.uniform(45, 55, 5)
-temperatura_con_fallos_entrenamiento[120:125] = np.random.uniform(5, 10, 5)
-temperatura_con_fallos_entrenamiento[200:205] = 23.0
-temperatura_con_fallos_entrenamiento[350:355] = np.random.uniform(40, 50, 5)
-
-data_for_model_training = temperatura_con_fallos_entrenamiento.reshape(-1, 1)
-
-if 'contamination_value' not in st.session_state:
-    st.session_state['contamination_value'] = 0.03 
-
-if 'sensor_models' not in st.session_state:
-    st.session_state['sensor_models'] = {}
-    for sensor_id in SENSOR_IDS:
-        model = IsolationForest(contamination=st.session_state['contamination_value'], random_state=42)
-        model.fit(data_for_model_training)
-        st.session_state['sensor_models'][sensor_id] = model
-
-if 'sensor_failure_state' not in st.session_state:
-    st.session_state['sensor_failure_state'] = {sensor_id: {'is_failed': False, 'original_type': 'N/A', 'original_suggestion': ''} for sensor_id in SENSOR_IDS}
-
-
-if 'total_anomalies_detected' not in st.session_state:
-    st.session_state['total_anomalies_detected'] = 0
-if 'total_alerts_sent' not in st.session_state:
-    st.session_state['total_alerts_sent'] = 0
-
-if 'simulation_speed' not in st.session_state:
-    st.session_state['simulation_speed'] = 0.5 
-
-if 'last_alert_time' not in st.session_state:
-    st.session_state['last_alert_time'] = {sensor_id: 0 for sensor_id in SENSOR_IDS} 
-COOLDOWN_SECONDS = 60 
-
-historial_columnas = ['Hora', 'Sensor ID', 'Lectura (°C)', 'Estado', 'Tipo de Anomalía', 'valor_numerico']
-if 'historial_lecturas_df' not in st.session_state:
-    st.session_state['historial_lecturas_df'] = pd.DataFrame(columns=historial_columnas)
-    st.session_state['historial_lecturas_df']['valor_numerico'] = st.session_state['historial_lecturas_df']['valor_numerico'].astype(float)
-
-if 'displayed_alert_message' not in st.session_state:
-    st.session_state['displayed_alert_message'] = ""
-if 'displayed_suggestion_message' not in st.session_state:
-    st.session_state['displayed_suggestion_message'] = ""
-
 THEMES = {
     "dark": {
         "app_bg": "#0A192F",
@@ -162,6 +147,7 @@ THEMES = {
     }
 }
 
+@st.cache_data
 def get_css_style(theme_name):
     theme = THEMES[theme_name]
     return f"""
@@ -340,8 +326,13 @@ def create_altair_theme(theme_name):
         }
     }
 
-alt.themes.register("custom_dark", lambda: create_altair_theme("dark"))
-alt.themes.register("custom_light", lambda: create_altair_theme("light"))
+@st.cache_resource
+def register_altair_themes():
+    # El registro de temas de Altair es global al proceso: basta con hacerlo una vez.
+    alt.themes.register("custom_dark", lambda: create_altair_theme("dark"))
+    alt.themes.register("custom_light", lambda: create_altair_theme("light"))
+
+register_altair_themes()
 
 
 if 'theme' not in st.session_state:
@@ -360,53 +351,131 @@ st.markdown("---")
 
 st.subheader("Monitoreo de Temperatura en Tiempo Real")
 
-kpi_container_anomalies = st.empty()
-kpi_container_alerts = st.empty()
+DISCORD_WEBHOOK_URL = st.secrets.get("DISCORD_WEBHOOK_URL")
+
+@st.cache_resource
+def get_metrics_registry():
+    return MetricsRegistry() if METRICS_ENABLED else None
+
+metrics = get_metrics_registry()
+timer = null_timer if metrics is None else metrics.timer
 
-with kpi_container_anomalies.container():
-    st.metric(label="Total Anomalías Detectadas", value=st.session_state['total_anomalies_detected'])
-with kpi_container_alerts.container():
-    st.metric(label="Alertas Discord Enviadas", value=st.session_state['total_alerts_sent'])
+@st.cache_data
+def get_training_data(seed, feature_window):
+    serie = make_training_series(seed=seed)
+    if feature_window:
+        return window_features(serie, feature_window)
+    return serie.reshape(-1, 1)
+
+@st.cache_resource
+def get_trained_model(contamination, seed, feature_window):
+    # Import diferido: sklearn solo se carga cuando hace falta entrenar por primera vez.
+    from models import RetunableIsolationForest
+    return RetunableIsolationForest(contamination=contamination, random_state=seed).fit(
+        get_training_data(seed, feature_window)
+    )
+
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry(MODEL_REGISTRY_PATH)
+
+model_registry = get_model_registry() if MODEL_REGISTRY_PATH else None
+
+@st.cache_resource
+def get_sensor_engine():
+    # Los sensores con una versión activa en el registro arrancan con ella (lectura por
+    # mmap, sin reentrenar); el resto usa el modelo compartido de datos sintéticos.
+    model = get_trained_model(MODEL_CONTAMINATION, 42, FEATURE_WINDOW)
+    sensor_models = {sensor_id: model for sensor_id in SENSOR_IDS}
+    if model_registry is not None:
+        sensor_models.update({
+            sensor_id: guardado for sensor_id, guardado in model_registry.load_fleet(SENSOR_IDS).items()
+            if guardado.metadata['feature_window'] == FEATURE_WINDOW
+        })
+    alert_dispatcher = get_alert_dispatcher(DISCORD_WEBHOOK_URL) if DISCORD_WEBHOOK_URL else None
+    storage_writer = StorageWriter(open_storage(STORAGE_BACKEND, STORAGE_PATH)).start() if STORAGE_BACKEND else None
+    engine = SensorEngine(
+        FleetSimulator(SENSOR_COUNT, seed=42, failure_schedule=SIMULATOR_FAILURE_SCHEDULE,
+                       failure_probabilities=SIMULATOR_FAILURE_PROBABILITIES,
+                       recovery_probability=SIMULATOR_RECOVERY_PROBABILITY), sensor_models,
+        alert_dispatcher=alert_dispatcher, history_capacity=HISTORY_CAPACITY,
+        compiled_scorer=USE_COMPILED_SCORER, tz=MEXICO_CITY_TZ, storage_writer=storage_writer,
+        detector_bank=DetectorBank(SENSOR_COUNT, default=STREAMING_DETECTORS) if STREAMING_DETECTORS else None,
+        feature_extractor=SlidingWindowFeatures(SENSOR_COUNT, FEATURE_WINDOW) if FEATURE_WINDOW else None,
+        metrics=metrics, rollups=RollupStore(SENSOR_COUNT, CHART_ROLLUP_TIERS) if CHART_ROLLUP_TIERS else None,
+        contamination=MODEL_CONTAMINATION,
+    )
+    if engine.rollups is not None and storage_writer is not None:
+        # Los agregados de antes del arranque salen del disco en segundo plano; hasta que
+        # terminen, las ventanas largas muestran lo que ya se cargó.
+        engine.start_rollup_backfill(time.time())
+    return engine.start()
+
+engine = get_sensor_engine()
+
+@st.cache_resource
+def get_model_retrainer():
+    return ModelRetrainer(engine, interval=RETRAIN_INTERVAL_SECONDS, window=RETRAIN_WINDOW,
+                          min_samples=RETRAIN_MIN_SAMPLES, max_workers=RETRAIN_WORKERS,
+                          registry=model_registry).start()
+
+model_retrainer = get_model_retrainer() if RETRAIN_INTERVAL_SECONDS else None
+
+@st.cache_resource
+def get_ingest_server():
+    # Si el puerto está ocupado (otra instancia de la app, por ejemplo) el dashboard sigue sin
+    # ingesta por red y el error se muestra en la barra lateral.
+    try:
+        servidor = IngestServer(engine, host=INGEST_HOST, port=INGEST_PORT).start()
+    except OSError as e:
+        return None, str(e)
+    if metrics is not None:
+        metrics.register_gauge("ingest_queue_depth", lambda: servidor.metrics()['queue_depth'])
+    return servidor, None
+
+ingest_server, ingest_error = get_ingest_server() if INGEST_PORT else (None, None)
+
+@st.cache_resource
+def get_metrics_server():
+    # Como la ingesta: con el puerto ocupado la app sigue y avisa en el diagnóstico.
+    try:
+        return MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT).start(), None
+    except OSError as e:
+        return None, str(e)
+
+metrics_server, metrics_error = get_metrics_server() if metrics is not None and METRICS_PORT else (None, None)
+
+if not DISCORD_WEBHOOK_URL:
+    st.warning("🚨 ADVERTENCIA: La URL del Webhook de Discord no está configurada en los Streamlit Secrets.")
 
 control_cols = st.columns(2) 
 
 with control_cols[0]:
     st.markdown("##### Control de Simulación") 
-    st.session_state['simulation_speed'] = st.slider(
+    simulation_speed = st.slider(
         "Velocidad de Lectura (segundos por lectura)",
-        min_value=0.1, max_value=2.0, value=0.5, step=0.1,
-        help="Define el tiempo de espera entre cada lectura simulada."
+        min_value=0.1, max_value=2.0, value=float(engine.interval), step=0.1,
+        help="Define el tiempo de espera entre cada lectura simulada (aplica a todas las sesiones).",
+        disabled=not ALLOW_VIEWER_CONTROLS
     )
+    if ALLOW_VIEWER_CONTROLS and simulation_speed != engine.interval:
+        engine.set_interval(simulation_speed)
 
 with control_cols[1]:
     st.markdown("##### Control de Modelo IA")
     new_contamination_value = st.slider(
         "Sensibilidad Detección (Contamination)",
-        min_value=0.01, max_value=0.10, value=st.session_state['contamination_value'], step=0.005,
+        min_value=0.01, max_value=0.10, value=float(engine.contamination), step=0.005,
         format="%.3f",
-        help="Proporción esperada de anomalías. Mayor valor = más sensible."
+        help="Proporción esperada de anomalías. Mayor valor = más sensible (aplica a todas las sesiones).",
+        disabled=not ALLOW_VIEWER_CONTROLS
     )
-    if new_contamination_value != st.session_state['contamination_value']:
-        st.session_state['contamination_value'] = new_contamination_value
-        st.session_state['sensor_models'] = {}
-        for sensor_id in SENSOR_IDS:
-            model = IsolationForest(contamination=st.session_state['contamination_value'], random_state=42)
-            model.fit(data_for_model_training)
-            st.session_state['sensor_models'][sensor_id] = model
-        st.info("Modelos de IA re-entrenados con nueva sensibilidad.")
+    if ALLOW_VIEWER_CONTROLS and new_contamination_value != engine.contamination:
+        engine.set_contamination(new_contamination_value)
+        st.info("Umbral de los modelos de IA ajustado a la nueva sensibilidad.")
 
 st.markdown("---")
 
-alerta_container = st.empty()
-action_suggestion_container = st.empty()
-
-grafico_container = st.empty()
-historico_container = st.empty()
-status_indicator_container = st.empty() 
-
-
-st.write("Iniciando simulación de lecturas de múltiples sensores de temperatura...")
-
 st.sidebar.title("Configuración de Tema")
 selected_theme_option = st.sidebar.radio(
     "Selecciona el tema:",
@@ -424,171 +493,320 @@ elif selected_theme_option == 'Claro' and st.session_state['theme'] != 'light':
 current_theme_colors = THEMES[st.session_state['theme']]
 
 
-for i in range(1, 101):
-    
-    anomalies_in_this_iteration = False
-    
-    current_iteration_alert_message = ""
-    current_iteration_suggestion_message = ""
-
-    current_utc_time = datetime.now(timezone.utc)
-    current_mexico_city_time = current_utc_time.astimezone(MEXICO_CITY_TZ)
-    formatted_time_for_display = current_mexico_city_time.strftime('%H:%M:%S')
-
-    for idx, sensor_id in enumerate(SENSOR_IDS):
-        nueva_lectura = 0.0
-        tipo_anomalia_display = "N/A"
-        sugerencia_accion_display = ""
-
-        if st.session_state['sensor_failure_state'][sensor_id]['is_failed']:
-            original_type = st.session_state['sensor_failure_state'][sensor_id]['original_type']
-            original_suggestion = st.session_state['sensor_failure_state'][sensor_id]['original_suggestion']
-            
-            tipo_anomalia_display = original_type + " (Persistente)"
-            sugerencia_accion_display = original_suggestion
-
-            if original_type == "Pico Alto":
-                nueva_lectura = np.random.uniform(45, 55, 1)[0]
-            elif original_type == "Caída Baja":
-                nueva_lectura = np.random.uniform(5, 10, 1)[0]
-            elif original_type == "Valor Constante":
-                nueva_lectura = 23.0 + np.random.uniform(-1, 1, 1)[0]
-            else: 
-                nueva_lectura = 25 + 2 * np.random.randn(1)[0]
-                nueva_lectura = np.clip(nueva_lectura, 20, 30)
-                
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_alert_metrics():
+    st.markdown("##### Despacho de Alertas Discord")
+    if not DISCORD_WEBHOOK_URL:
+        st.caption("Webhook no configurado.")
+        return
+    metricas = get_alert_dispatcher(DISCORD_WEBHOOK_URL).metrics()
+    st.caption(f"En cola: {metricas['queue_depth']} · Enviadas: {metricas['sent_alerts']} "
+               f"({metricas['sent_messages']} mensajes) · Descartadas: {metricas['dropped']} · "
+               f"Fallidas: {metricas['failed_alerts']}")
+    st.caption(f"Latencia media: {metricas['avg_latency_s'] * 1000:.0f} ms · "
+               f"Máxima: {metricas['max_latency_s'] * 1000:.0f} ms · Límite 429: {metricas['rate_limited']}")
+    if metricas['last_error']:
+        st.caption(f"Último error: {metricas['last_error']}")
+
+
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_ingest_metrics():
+    st.markdown("##### Ingesta por Red")
+    if ingest_error is not None:
+        st.warning(f"No se pudo abrir el puerto de ingesta {INGEST_HOST}:{INGEST_PORT}: {ingest_error}")
+        return
+    if ingest_server is None:
+        st.caption("Servidor de ingesta deshabilitado.")
+        return
+    metricas = ingest_server.metrics()
+    st.caption(f"{INGEST_HOST}:{ingest_server.port} · Conexiones activas: {len(metricas['connections'])} · "
+               f"Lecturas procesadas: {metricas['processed_readings']} · En cola: {metricas['queue_depth']}")
+    if metricas['failed_batches']:
+        st.caption(f"Lotes fallidos: {metricas['failed_batches']} ({metricas['failed_readings']} lecturas) · "
+                   f"Último error: {metricas['last_error']}")
+    for conexion in metricas['connections']:
+        st.caption(f"{conexion['peer']}: {conexion['readings_per_s']:.0f} lecturas/s · "
+                   f"{conexion['readings']} lecturas · {conexion['rejected']} rechazadas · {conexion['errors']} errores")
+
+
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_live_status():
+    snapshot = engine.snapshot()
+
+    kpi_cols = st.columns(3)
+    with kpi_cols[0]:
+        st.metric(label="Total Anomalías Detectadas", value=snapshot['total_anomalies_detected'])
+    with kpi_cols[1]:
+        st.metric(label="Incidentes Abiertos", value=snapshot['open_incidents'])
+    with kpi_cols[2]:
+        st.metric(label="Alertas Discord Enviadas", value=snapshot['total_alerts_sent'])
+    if snapshot['detector_hits']:
+        st.caption("Detecciones en línea: " + " · ".join(f"{nombre}: {total}" for nombre, total in snapshot['detector_hits'].items()))
+
+    if snapshot['displayed_alert_message']:
+        st.error(snapshot['displayed_alert_message'])
+    if snapshot['displayed_suggestion_message']:
+        st.info(snapshot['displayed_suggestion_message'])
+
+    if snapshot['any_sensor_failed']:
+        st.error("🔴 ESTADO ACTUAL: ANOMALÍA(S) DETECTADA(S)")
+    else:
+        st.success("🟢 ESTADO ACTUAL: Normal")
+
+    if snapshot['incidents']:
+        totales = snapshot['incident_totals']
+        with st.expander(f"Incidentes abiertos ({snapshot['open_incidents']})"):
+            st.dataframe([
+                {'Incidente': f"#{incidente['incident_id']}", 'Sensor ID': SENSOR_IDS[incidente['sensor']],
+                 'Tipo de Anomalía': ANOMALY_TYPE_LABELS[incidente['anomaly_type']],
+                 'Desde': datetime.fromtimestamp(incidente['started_at'], MEXICO_CITY_TZ).strftime('%H:%M:%S'),
+                 'Lecturas': incidente['count'], 'Mín (°C)': round(incidente['min_value'], 2),
+                 'Máx (°C)': round(incidente['max_value'], 2), 'Nivel': incidente['level']}
+                for incidente in snapshot['incidents']
+            ], hide_index=True)
+            st.caption(f"Abiertos: {totales[INCIDENT_OPENED]} · Escalados: {totales[INCIDENT_ESCALATED]} · "
+                       f"Resueltos: {totales[INCIDENT_RESOLVED]} (desde el arranque)")
+
+
+def build_trend_chart(df_para_grafico, chart_title, theme_colors):
+    line_chart = alt.Chart(df_para_grafico).mark_line().encode( 
+        x=alt.X('Hora:T', title='Tiempo', axis=alt.Axis(format='%H:%M:%S')),
+        y=alt.Y('Lectura (°C):Q', title='Temperatura (°C)'), 
+        color=alt.Color('Sensor ID', title='Sensor', scale=alt.Scale(range=theme_colors['chart_line_colors'])), 
+        tooltip=[
+            alt.Tooltip('Hora:T', title='Hora', format='%H:%M:%S'),
+            alt.Tooltip('Sensor ID', title='Sensor'),
+            alt.Tooltip('Lectura (°C):Q', title='Temp', format='.2f'),
+            alt.Tooltip('Estado', title='Estado')
+        ]
+    )
+
+    anomaly_points = alt.Chart(df_para_grafico[df_para_grafico['Estado'] == 'ANOMALÍA DETECTADA']).mark_point(
+        color=theme_colors['anomaly_highlight'], filled=True, size=120, shape='cross' 
+    ).encode(
+        x=alt.X('Hora:T'),
+        y=alt.Y('Lectura (°C):Q'),
+        tooltip=[
+            alt.Tooltip('Hora:T', title='Hora', format='%H:%M:%S'),
+            alt.Tooltip('Sensor ID', title='Sensor'),
+            alt.Tooltip('Lectura (°C):Q', title='Temp', format='.2f'),
+            alt.Tooltip('Estado', title='Estado'),
+            alt.Tooltip('Tipo de Anomalía', title='Tipo Anomalía')
+        ]
+    )
+
+    return alt.layer(line_chart, anomaly_points).properties(
+        title=alt.Title(chart_title, anchor='middle'),
+        background=theme_colors['chart_background']
+    ).interactive()
+
+
+def build_rollup_chart(df_agregados, chart_title, theme_colors):
+    # Ventanas largas desde los agregados: promedio por bucket con la banda mínimo-máximo
+    # y marcas en los buckets que tuvieron anomalías.
+    color = alt.Color('Sensor ID', title='Sensor', scale=alt.Scale(range=theme_colors['chart_line_colors']))
+    tooltip = [
+        alt.Tooltip('Hora:T', title='Desde', format='%Y-%m-%d %H:%M'),
+        alt.Tooltip('Sensor ID', title='Sensor'),
+        alt.Tooltip('Promedio (°C):Q', title='Promedio', format='.2f'),
+        alt.Tooltip('Mínimo (°C):Q', title='Mínimo', format='.2f'),
+        alt.Tooltip('Máximo (°C):Q', title='Máximo', format='.2f'),
+        alt.Tooltip('Lecturas:Q', title='Lecturas'),
+        alt.Tooltip('Anomalías:Q', title='Anomalías'),
+    ]
+    base = alt.Chart(df_agregados).encode(x=alt.X('Hora:T', title='Tiempo'), color=color)
+    banda = base.mark_area(opacity=0.2).encode(y=alt.Y('Mínimo (°C):Q', title='Temperatura (°C)'), y2='Máximo (°C):Q')
+    promedio = base.mark_line().encode(y='Promedio (°C):Q', tooltip=tooltip)
+    anomalias = alt.Chart(df_agregados[df_agregados['Anomalías'] > 0]).mark_point(
+        color=theme_colors['anomaly_highlight'], filled=True, size=120, shape='cross'
+    ).encode(x=alt.X('Hora:T'), y=alt.Y('Máximo (°C):Q'), tooltip=tooltip)
+
+    return alt.layer(banda, promedio, anomalias).properties(
+        title=alt.Title(chart_title, anchor='middle'),
+        background=theme_colors['chart_background']
+    ).interactive()
+
+
+def format_resolution(segundos):
+    if segundos >= 3600:
+        return f"{segundos / 3600:g} h"
+    return f"{segundos / 60:g} min" if segundos >= 60 else f"{segundos:g} s"
+
+
+def highlight_anomalies(df, status_codes):
+    # El resaltado sale del código de estado ya calculado, no de comparar el texto de cada celda.
+    estilos = np.where(status_codes == STATUS_ANOMALY,
+                       f'background-color: {current_theme_colors["anomaly_highlight"]}; color: white; font-weight: bold;', '')
+    return df.style.apply(lambda _: estilos, subset=['Estado'], axis=0).format(HISTORY_DISPLAY_FORMATS)
+
+
+@st.cache_resource(max_entries=32)
+def get_trend_chart(version, theme_name, ventana):
+    # Un gráfico por (lote, tema, ventana) para todo el proceso: las sesiones que miran lo
+    # mismo comparten la consulta, el diezmado y la construcción del gráfico de Altair.
+    segundos = CHART_WINDOWS[ventana]
+    agregados = None if segundos is None else engine.rollup_window(segundos, CHART_MAX_POINTS_PER_SENSOR)
+    if agregados is not None:
+        # Ventana larga: el tier de agregados que la cubre, sin leer lecturas crudas.
+        resolucion, columnas = agregados
+        df_agregados = rollups_to_dataframe(columnas, engine.history.sensor_labels, tz=MEXICO_CITY_TZ)
+        with timer("chart_build"):
+            chart = build_rollup_chart(df_agregados, f'{ventana} por Sensor (promedio cada {format_resolution(resolucion)})',
+                                       THEMES[theme_name])
+        return {'points': len(df_agregados), 'raw_points': int(columnas['count'].sum()), 'chart': chart,
+                'partial': engine.rollups_backfilling}
+    columnas = engine.history_window(seconds=segundos, n=30 * len(SENSOR_IDS) if segundos is None else None)
+    filas = decimate_indices(columnas, max_points_per_sensor=CHART_MAX_POINTS_PER_SENSOR)
+    df_para_grafico = columns_to_dataframe(
+        {name: column[filas] for name, column in columnas.items()}, engine.history.sensor_labels, tz=MEXICO_CITY_TZ
+    )
+    with timer("chart_build"):
+        chart = build_trend_chart(df_para_grafico, f'{ventana} por Sensor', THEMES[theme_name])
+    return {'points': len(filas), 'raw_points': len(columnas['value']), 'chart': chart, 'partial': False}
+
+
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_trend_chart():
+    # El gráfico solo se reconstruye cuando el motor agregó lecturas nuevas o cambió el
+    # tema o la ventana, y una sola vez por proceso aunque haya muchas sesiones abiertas.
+    st.subheader("Gráfico de Tendencia de Temperatura")
+    ventana = st.selectbox("Ventana del gráfico", list(CHART_WINDOWS), key='chart_window')
+
+    grafico = get_trend_chart(engine.snapshot()['version'], st.session_state['theme'], ventana)
+    st.caption(f"{grafico['points']} puntos dibujados de {grafico['raw_points']} lecturas en la ventana.")
+    if grafico['partial']:
+        st.caption("⏳ Cargando desde el disco las lecturas anteriores al arranque: la ventana puede verse incompleta.")
+    st.altair_chart(grafico['chart'], use_container_width=True)
+
+
+@st.cache_data(max_entries=64)
+def get_history_page(version, page, page_size, sensors, statuses, anomaly_types, segundos):
+    # Compartido entre sesiones con el mismo filtro y página mientras no lleguen lecturas nuevas.
+    return engine.history_page(
+        page, page_size, sensors=sensors, statuses=statuses, anomaly_types=anomaly_types,
+        start=None if segundos is None else time.time() - segundos,
+    )
+
+
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_history_table():
+    # Filtrado y paginado sobre todo el historial guardado; solo las filas de la página
+    # se convierten a DataFrame y se estilizan.
+    st.subheader("Historial de Lecturas Recientes")
+    filtro_cols = st.columns(4)
+    sensores = filtro_cols[0].multiselect("Sensor", SENSOR_IDS, key='tabla_sensores')
+    estados = filtro_cols[1].multiselect("Estado", STATUS_LABELS, key='tabla_estados')
+    tipos = filtro_cols[2].multiselect("Tipo de Anomalía", ANOMALY_TYPE_LABELS, key='tabla_tipos')
+    rango = filtro_cols[3].selectbox("Rango de tiempo", list(TABLE_TIME_RANGES), key='tabla_rango')
+    pagina_cols = st.columns(2)
+    page_size = pagina_cols[0].selectbox("Filas por página", TABLE_PAGE_SIZES, key='tabla_filas')
+    pagina = pagina_cols[1].number_input("Página", min_value=1, step=1, key='tabla_pagina')
+
+    columnas, total, pagina_mostrada = get_history_page(
+        engine.snapshot()['version'], pagina - 1, page_size,
+        tuple(SENSOR_INDEX[sensor_id] for sensor_id in sensores) or None,
+        tuple(STATUS_LABELS.index(estado) for estado in estados) or None,
+        tuple(ANOMALY_TYPE_CODES[tipo] for tipo in tipos) or None,
+        TABLE_TIME_RANGES[rango],
+    )
+    df_historial = columns_to_dataframe(columnas, engine.history.sensor_labels, tz=MEXICO_CITY_TZ)
+    with timer("table_style"):
+        tabla = highlight_anomalies(df_historial, columnas['status'])
+    st.dataframe(tabla)
+    st.caption(f"Página {pagina_mostrada + 1} de {max(1, -(-total // page_size))} · {total} lecturas coinciden con el filtro.")
+
+
+@st.fragment(run_every=FRAME_INTERVAL_SECONDS)
+def render_diagnostics():
+    st.markdown("##### Diagnóstico")
+    if metrics is None:
+        st.caption("Instrumentación deshabilitada.")
+        return
+    etapas = metrics.stage_summary()
+    if etapas:
+        st.dataframe([
+            {'Etapa': etapa, 'N': datos['count'], 'Media (ms)': round(datos['mean_s'] * 1000, 2),
+             'p50 (ms)': round(datos['p50_s'] * 1000, 2), 'p99 (ms)': round(datos['p99_s'] * 1000, 2)}
+            for etapa, datos in sorted(etapas.items())
+        ], hide_index=True)
+    contadores = metrics.counters()
+    gauges = metrics.gauges()
+    st.caption(f"Lecturas: {contadores.get('readings_total', 0)} · Anomalías: {contadores.get('anomalies_total', 0)} · "
+               f"Cola de alertas: {gauges.get('alert_queue_depth', 0):.0f} · "
+               f"Historial: {gauges.get('history_rows', 0):.0f} filas / {gauges.get('history_bytes', 0) / 2**20:.1f} MiB")
+    if model_retrainer is not None:
+        reentreno = model_retrainer.metrics()
+        if reentreno['last_retrain_at'] is None:
+            st.caption(f"Modelos por sensor: aún sin reentrenar (cada {RETRAIN_INTERVAL_SECONDS} s, con al menos "
+                       f"{RETRAIN_MIN_SAMPLES} lecturas normales por sensor).")
         else:
-            if (i + idx) % 10 == 0:
-                nueva_lectura = np.random.uniform(45, 55, 1)[0]
-                tipo_anomalia_display = "Pico Alto"
-                sugerencia_accion_display = "Revisar posibles sobrecargas, fallos en ventilación o componentes sobrecalentados."
-                st.session_state['sensor_failure_state'][sensor_id] = {'is_failed': True, 'original_type': "Pico Alto", 'original_suggestion': sugerencia_accion_display}
-            elif (i + idx) % 15 == 0:
-                nueva_lectura = np.random.uniform(5, 10, 1)[0]
-                tipo_anomalia_display = "Caída Baja"
-                sugerencia_accion_display = "Verificar si el sensor está desconectado, dañado o hay un problema en la fuente de energía."
-                st.session_state['sensor_failure_state'][sensor_id] = {'is_failed': True, 'original_type': "Caída Baja", 'original_suggestion': sugerencia_accion_display}
-            elif (i + idx) % 25 == 0:
-                nueva_lectura = 23.0 + np.random.uniform(-1, 1, 1)[0]
-                tipo_anomalia_display = "Valor Constante"
-                sugerencia_accion_display = "Inspeccionar el sensor por posibles fallas de congelación, cortocircuito o falta de comunicación."
-                st.session_state['sensor_failure_state'][sensor_id] = {'is_failed': True, 'original_type': "Valor Constante", 'original_suggestion': sugerencia_accion_display}
-            else:
-                nueva_lectura = 25 + 2 * np.random.randn(1)[0]
-                nueva_lectura = np.clip(nueva_lectura, 20, 30)
-                tipo_anomalia_display = "N/A"
-                sugerencia_accion_display = ""
-                st.session_state['sensor_failure_state'][sensor_id] = {'is_failed': False, 'original_type': 'N/A', 'original_suggestion': ''}
-
-        model = st.session_state['sensor_models'][sensor_id]
-        prediccion = model.predict(np.array(nueva_lectura).reshape(-1, 1))
-
-        estado_lectura = "Normal"
-        
-        if prediccion == -1 or st.session_state['sensor_failure_state'][sensor_id]['is_failed']:
-            if prediccion == -1: 
-                st.session_state['total_anomalies_detected'] += 1 
-                current_time = time.time()
-                if (current_time - st.session_state['last_alert_time'][sensor_id]) > COOLDOWN_SECONDS:
-                    send_discord_alert(sensor_id, nueva_lectura, tipo_anomalia_display, sugerencia_accion_display) 
-                    st.session_state['last_alert_time'][sensor_id] = current_time 
-                    st.session_state['total_alerts_sent'] += 1 
-
-            estado_lectura = "ANOMALÍA DETECTADA"
-            anomalies_in_this_iteration = True 
-
-            current_iteration_alert_message = (f"🚨 **¡ALERTA!** Se ha detectado una **ANOMALÍA** "
-                                                f"({tipo_anomalia_display}) en el sensor **{sensor_id}**: **{nueva_lectura:.2f}°C**. "
-                                                f"¡Se recomienda revisar el sistema!")
-            current_iteration_suggestion_message = (f"💡 **Sugerencia de Acción para {sensor_id}:** {sugerencia_accion_display}")
-        
-        nueva_fila_historial = pd.DataFrame([{
-            'Hora': formatted_time_for_display, 
-            'Sensor ID': sensor_id,
-            'Lectura (°C)': f"{nueva_lectura:.2f}",
-            'Estado': estado_lectura,
-            'Tipo de Anomalía': tipo_anomalia_display, 
-            'valor_numerico': nueva_lectura
-        }])
-        st.session_state['historial_lecturas_df'] = pd.concat([st.session_state['historial_lecturas_df'], nueva_fila_historial], ignore_index=True)
-
-    with kpi_container_anomalies.container():
-        st.metric(label="Total Anomalías Detectadas", value=st.session_state['total_anomalies_detected'])
-    with kpi_container_alerts.container():
-        st.metric(label="Alertas Discord Enviadas", value=st.session_state['total_alerts_sent'])
-
-    any_sensor_failed = any(st.session_state['sensor_failure_state'][s_id]['is_failed'] for s_id in SENSOR_IDS)
-
-    with status_indicator_container:
-        if any_sensor_failed:
-            st.error("🔴 ESTADO ACTUAL: ANOMALÍA(S) DETECTADA(S)")
+            st.caption(f"Modelos por sensor: {reentreno['retrains']} reentrenamientos · último hace "
+                       f"{time.time() - reentreno['last_retrain_at']:.0f} s ({reentreno['last_duration_s']:.1f} s)")
+        if reentreno['last_error']:
+            st.caption(f"Error de reentrenamiento: {reentreno['last_error']}")
+    if metrics_server is not None:
+        st.caption(f"Prometheus: http://{METRICS_HOST}:{metrics_server.port}/metrics")
+    elif metrics_error is not None:
+        st.warning(f"No se pudo abrir el puerto de métricas {METRICS_HOST}:{METRICS_PORT}: {metrics_error}")
+
+
+def apply_registry_action(action, sensor_id, version=None):
+    # Callback de los botones: corre antes del rerun, así la vista ya sale con el estado nuevo.
+    try:
+        if action == "pin":
+            model_registry.pin(sensor_id, version)
+            mensaje = f"{sensor_id} fijado en v{version}."
+        elif action == "rollback":
+            mensaje = f"{sensor_id} revertido a v{model_registry.rollback(sensor_id)}."
         else:
-            st.success("🟢 ESTADO ACTUAL: Normal")
-    
-    if any_sensor_failed:
-        if current_iteration_alert_message:
-            st.session_state['displayed_alert_message'] = current_iteration_alert_message
-            st.session_state['displayed_suggestion_message'] = current_iteration_suggestion_message
-    else:
-        st.session_state['displayed_alert_message'] = "" 
-        st.session_state['displayed_suggestion_message'] = ""
-    
-    if st.session_state['displayed_alert_message']:
-        alerta_container.error(st.session_state['displayed_alert_message'])
-    else:
-        alerta_container.empty()
+            model_registry.unpin(sensor_id)
+            mensaje = f"{sensor_id} vuelve a la versión más reciente."
+    except (KeyError, ValueError) as e:
+        st.session_state['registro_mensaje'] = ("error", str(e))
+        return
+    engine.swap_models({sensor_id: model_registry.load(sensor_id)})
+    st.session_state['registro_mensaje'] = ("success", mensaje)
 
-    if st.session_state['displayed_suggestion_message']:
-        action_suggestion_container.info(st.session_state['displayed_suggestion_message'])
-    else:
-        action_suggestion_container.empty()
-
-
-    with grafico_container.container():
-        st.subheader("Gráfico de Tendencia de Temperatura")
-        num_lecturas_grafico = 30 * len(SENSOR_IDS) 
-        df_para_grafico = st.session_state['historial_lecturas_df'].tail(num_lecturas_grafico).copy()
-        
-        line_chart = alt.Chart(df_para_grafico).mark_line().encode( 
-            x=alt.X('Hora', title='Tiempo'),
-            y=alt.Y('valor_numerico', title='Temperatura (°C)'), 
-            color=alt.Color('Sensor ID', title='Sensor', scale=alt.Scale(range=current_theme_colors['chart_line_colors'])), 
-            tooltip=[
-                alt.Tooltip('Hora', title='Hora'), 
-                alt.Tooltip('Sensor ID', title='Sensor'),
-                alt.Tooltip('valor_numerico', title='Temp', format='.2f'),
-                alt.Tooltip('Estado', title='Estado')
-            ]
-        )
-
-        anomaly_points = alt.Chart(df_para_grafico[df_para_grafico['Estado'] == 'ANOMALÍA DETECTADA']).mark_point(
-            color=current_theme_colors['anomaly_highlight'], filled=True, size=120, shape='cross' 
-        ).encode(
-            x=alt.X('Hora'),
-            y=alt.Y('valor_numerico'),
-            tooltip=[
-                alt.Tooltip('Hora', title='Hora'), 
-                alt.Tooltip('Sensor ID', title='Sensor'),
-                alt.Tooltip('valor_numerico', title='Temp', format='.2f'),
-                alt.Tooltip('Estado', title='Estado'),
-                alt.Tooltip('Tipo de Anomalía', title='Tipo Anomalía')
-            ]
-        )
-
-        chart = alt.layer(line_chart, anomaly_points).properties(
-            title=alt.Title(f'Últimas {num_lecturas_grafico // len(SENSOR_IDS)} Lecturas por Sensor', anchor='middle'),
-            background=current_theme_colors['chart_background']
-        ).interactive()
-        
-        st.altair_chart(chart, use_container_width=True)
-
-    with historico_container.container():
-        st.subheader("Historial de Lecturas Recientes")
-        def highlight_anomalies(s):
-            return [f'background-color: {current_theme_colors["anomaly_highlight"]}; color: white; font-weight: bold;' if 'ANOMALÍA' in str(v) else '' for v in s]
-
-        st.dataframe(st.session_state['historial_lecturas_df'].tail(15 * len(SENSOR_IDS)).style.apply(highlight_anomalies, axis=1))
-
-    time.sleep(st.session_state['simulation_speed']) 
-
-st.success("✅ Simulación de monitoreo de sensores de temperatura finalizada.")
+
+def render_model_registry():
+    st.markdown("##### Registro de Modelos")
+    if model_registry is None:
+        st.caption("Registro deshabilitado.")
+        return
+    sensor_id = st.selectbox("Sensor", SENSOR_IDS, key='registro_sensor')
+    versiones = model_registry.versions(sensor_id)
+    if not versiones:
+        st.caption("Sin versiones guardadas (usa el modelo compartido).")
+        return
+    fijada = model_registry.is_pinned(sensor_id)
+    st.caption(f"Activa: v{model_registry.active_version(sensor_id)}{' (fijada)' if fijada else ''} · en uso: "
+               f"v{getattr(engine.sensor_models[sensor_id], 'version', '—')}")
+    st.dataframe([
+        {'Versión': metadata['version'], 'Ventana': metadata['window'],
+         'Contaminación': metadata['contamination'], 'Hash datos': metadata['data_hash'],
+         'Creada': time.strftime('%Y-%m-%d %H:%M', time.localtime(metadata['created_at']))}
+        for metadata in reversed(versiones)
+    ], hide_index=True)
+    version = st.selectbox("Versión", [metadata['version'] for metadata in reversed(versiones)], key='registro_version')
+    botones = st.columns(3)
+    botones[0].button("Fijar", on_click=apply_registry_action, args=("pin", sensor_id, version),
+                      disabled=not ALLOW_VIEWER_CONTROLS)
+    botones[1].button("Revertir", on_click=apply_registry_action, args=("rollback", sensor_id),
+                      disabled=not ALLOW_VIEWER_CONTROLS or len(versiones) < 2)
+    botones[2].button("Liberar", on_click=apply_registry_action, args=("unpin", sensor_id),
+                      disabled=not ALLOW_VIEWER_CONTROLS or not fijada)
+    mensaje = st.session_state.pop('registro_mensaje', None)
+    if mensaje:
+        (st.success if mensaje[0] == "success" else st.error)(mensaje[1])
+
+
+with st.sidebar:
+    render_alert_metrics()
+    render_ingest_metrics()
+    render_diagnostics()
+    render_model_registry()
+
+render_live_status()
+st.markdown("---")
+render_trend_chart()
+render_history_table()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from detectors import DetectorBank
+from engine import SensorEngine
+from features import SlidingWindowFeatures
+from incidents import ESCALATION_COUNTS, RESOLVE_AFTER_SECONDS, IncidentTracker
+from simulation import make_training_series
+from training import _pool_context, fit_sensor_model
+
+# Reproducción de lecturas históricas (CSV o Parquet con columnas timestamp, sensor o
+# sensor_id, value) por el mismo process_readings del motor, sin pausas ni interfaz, y
+# barridos de contaminación / detectores en procesos paralelos. Uso:
+#   python backtest.py replay lecturas.parquet --contamination 0.03
+#   python backtest.py sweep lecturas.csv --contaminations 0.01 0.03 0.05 --detector-sets flatline,rate_of_change none
+
+SENSOR_COLUMNS = ("sensor", "sensor_id")
+
+
+def _is_parquet(path):
+    return os.path.isdir(path) or path.endswith((".parquet", ".pq"))
+
+
+def iter_chunks(path, chunk_size=200_000, columns=None):
+    # DataFrames de a lo sumo chunk_size filas; Parquet (archivo o carpeta particionada
+    # como la de ParquetStorage) se lee por lotes con pyarrow, CSV con pandas.
+    if _is_parquet(path):
+        try:
+            import pyarrow.dataset as ds
+        except ImportError as e:
+            raise ImportError("Leer Parquet requiere pyarrow (pip install pyarrow)") from e
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        for lote in dataset.to_batches(columns=columns, batch_size=chunk_size):
+            yield lote.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+
+def _sensor_column(path):
+    columnas = next(iter_chunks(path, chunk_size=1)).columns
+    for nombre in SENSOR_COLUMNS:
+        if nombre in columnas:
+            return nombre
+    raise ValueError(f"{path} no tiene columna de sensor ({' o '.join(SENSOR_COLUMNS)})")
+
+
+def discover_sensors(path, chunk_size=200_000):
+    # Primera pasada solo sobre la columna de sensor para fijar el orden de los índices.
+    columna = _sensor_column(path)
+    vistos = set()
+    for chunk in iter_chunks(path, chunk_size, columns=[columna]):
+        vistos.update(pd.unique(chunk[columna]).tolist())
+    if columna == "sensor":
+        return [f"Sensor_{idx + 1:03d}" for idx in range(int(max(vistos)) + 1)], columna
+    return sorted(vistos), columna
+
+
+def _timestamps(serie):
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.to_numpy(dtype=np.float64)
+    # Segundos epoch sin depender de la unidad con la que pandas parsea las horas (ns o us).
+    horas = pd.to_datetime(serie, utc=True)
+    return ((horas - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+def build_replay_engine(sensor_ids, contamination=0.03, detectors=("flatline", "rate_of_change"),
+                        feature_window=None, resolve_after=RESOLVE_AFTER_SECONDS, escalation_counts=ESCALATION_COUNTS,
+                        registry_path=None, history_capacity=10_000):
+    model = fit_sensor_model(make_training_series(seed=42), contamination=contamination, random_state=42,
+                             feature_window=feature_window)
+    sensor_models = {sensor_id: model for sensor_id in sensor_ids}
+    if registry_path:
+        from model_registry import ModelRegistry
+
+        sensor_models.update(ModelRegistry(registry_path).load_fleet(sensor_ids))
+    engine = SensorEngine(
+        None, sensor_models, sensor_ids=sensor_ids, history_capacity=history_capacity,
+        incident_tracker=IncidentTracker(len(sensor_ids), resolve_after=resolve_after, escalation_counts=escalation_counts),
+        detector_bank=DetectorBank(len(sensor_ids), default=tuple(detectors)) if detectors else None,
+        feature_extractor=SlidingWindowFeatures(len(sensor_ids), feature_window) if feature_window else None,
+        event_time=True,
+    )
+    engine.set_contamination(contamination)
+    return engine
+
+
+def replay(path, sensor_ids=None, sensor_column=None, chunk_size=200_000, **engine_params):
+    if sensor_ids is None:
+        sensor_ids, sensor_column = discover_sensors(path, chunk_size)
+    sensor_column = sensor_column or _sensor_column(path)
+    indice = {sensor_id: idx for idx, sensor_id in enumerate(sensor_ids)}
+    engine = build_replay_engine(sensor_ids, **engine_params)
+
+    lecturas = 0
+    inicio = time.perf_counter()
+    for chunk in iter_chunks(path, chunk_size, columns=["timestamp", sensor_column, "value"]):
+        timestamps = _timestamps(chunk["timestamp"])
+        if sensor_column == "sensor":
+            sensor = chunk["sensor"].to_numpy(dtype=np.intp)
+        else:
+            sensor = chunk[sensor_column].map(indice).to_numpy(dtype=np.intp)
+        values = chunk["value"].to_numpy(dtype=np.float64)
+        orden = np.argsort(timestamps, kind="stable")
+        engine.process_readings(sensor[orden], timestamps[orden], values[orden])
+        lecturas += len(values)
+    duracion = time.perf_counter() - inicio
+
+    return {
+        'params': {name: list(valor) if isinstance(valor, tuple) else valor for name, valor in engine_params.items()},
+        'readings': lecturas,
+        'elapsed_s': duracion,
+        'readings_per_s': lecturas / duracion if duracion else 0.0,
+        'anomalies': int(engine.anomaly_counts.sum()),
+        'incidents': int(engine.incidents.opened_counts.sum()),
+        'incident_events': dict(engine.incidents.totals),
+        'per_sensor': {
+            sensor_id: {'anomalies': int(engine.anomaly_counts[idx]), 'incidents': int(engine.incidents.opened_counts[idx])}
+            for idx, sensor_id in enumerate(sensor_ids)
+        },
+        'detector_hits': {} if engine.detector_bank is None else dict(zip(engine.detector_bank.names, engine.detector_bank.hits.tolist())),
+    }
+
+
+def _replay_config(args):
+    path, sensor_ids, sensor_column, chunk_size, params = args
+    return replay(path, sensor_ids, sensor_column, chunk_size, **params)
+
+
+def sweep(path, configs, max_workers=None, chunk_size=200_000):
+    # Cada configuración (contaminación, detectores, ...) se reproduce completa en su
+    # propio proceso; el archivo se lee en paralelo por cada una.
+    sensor_ids, sensor_column = discover_sensors(path, chunk_size)
+    tareas = [(path, sensor_ids, sensor_column, chunk_size, config) for config in configs]
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=_pool_context()) as pool:
+        resultados = list(pool.map(_replay_config, tareas))
+    duracion = time.perf_counter() - inicio
+    return {
+        'path': path,
+        'sensors': len(sensor_ids),
+        'elapsed_s': duracion,
+        'readings_per_s': sum(resultado['readings'] for resultado in resultados) / duracion if duracion else 0.0,
+        'results': resultados,
+    }
+
+
+def _detector_set(texto):
+    return () if texto in ("", "none") else tuple(nombre.strip() for nombre in texto.split(","))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproducción y barridos de sensibilidad sobre lecturas históricas.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for nombre in ("replay", "sweep"):
+        comando = sub.add_parser(nombre)
+        comando.add_argument("path")
+        comando.add_argument("--chunk-size", type=int, default=200_000)
+        comando.add_argument("--resolve-after", type=float, default=RESOLVE_AFTER_SECONDS,
+                             help="segundos sin anomalías para dar un incidente por resuelto")
+        comando.add_argument("--escalation-counts", type=int, nargs="+", default=list(ESCALATION_COUNTS))
+        comando.add_argument("--feature-window", type=int, default=None)
+        comando.add_argument("--registry", default=None, help="carpeta del registro de modelos por sensor")
+        comando.add_argument("--output", default=None)
+    replay_cmd = sub.choices["replay"]
+    replay_cmd.add_argument("--contamination", type=float, default=0.03)
+    replay_cmd.add_argument("--detectors", default="flatline,rate_of_change", help="separados por coma o 'none'")
+    sweep_cmd = sub.choices["sweep"]
+    sweep_cmd.add_argument("--contaminations", type=float, nargs="+", default=[0.01, 0.02, 0.03, 0.05, 0.1])
+    sweep_cmd.add_argument("--detector-sets", nargs="+", default=["flatline,rate_of_change"],
+                           help="conjuntos de detectores separados por coma; 'none' para ninguno")
+    sweep_cmd.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    comunes = {'resolve_after': args.resolve_after, 'escalation_counts': tuple(args.escalation_counts), 'feature_window': args.feature_window, 'registry_path': args.registry}
+    if args.command == "replay":
+        resultado = replay(args.path, chunk_size=args.chunk_size, contamination=args.contamination,
+                           detectors=_detector_set(args.detectors), **comunes)
+        filas = [resultado]
+    else:
+        configs = [dict(comunes, contamination=contaminacion, detectors=_detector_set(detectores))
+                   for contaminacion in args.contaminations for detectores in args.detector_sets]
+        resultado = sweep(args.path, configs, max_workers=args.workers, chunk_size=args.chunk_size)
+        filas = resultado['results']
+
+    for fila in filas:
+        detectores = ",".join(fila['params']['detectors']) or "none"
+        print(f"contaminación={fila['params']['contamination']:<6} detectores={detectores:<28} "
+              f"anomalías={fila['anomalies']:<8} incidentes={fila['incidents']:<6} {fila['readings_per_s']:,.0f} lecturas/s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(resultado, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
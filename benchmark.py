@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from alerts import AlertDispatcher
+from detectors import DetectorBank
+from engine import SensorEngine
+from features import SlidingWindowFeatures, window_features
+from incidents import INCIDENT_OPENED, INCIDENT_RESOLVED, RESOLVE_AFTER_SECONDS, IncidentTracker
+from metrics import MetricsRegistry
+from models import RetunableIsolationForest
+from simulation import (LIVE_FAILURE_PROBABILITIES, LIVE_FAILURE_SCHEDULE, LIVE_RECOVERY_PROBABILITY, FleetSimulator,
+                        make_training_series)
+from storage import StorageWriter, open_storage
+
+# Ciclo simular -> evaluar -> guardar -> alertar del tablero sin Streamlit, con las alertas
+# dirigidas a un webhook local de prueba. Uso:
+#   python benchmark.py --sensors 1000 --ticks 500 --history 50000 --output bench.json
+
+
+class _WebhookStub(BaseHTTPRequestHandler):
+    requests_received = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).requests_received += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_webhook_stub():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookStub)
+    threading.Thread(target=servidor.serve_forever, name="webhook-stub", daemon=True).start()
+    return servidor
+
+
+def peak_rss_bytes():
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == "darwin" else maximo * 1024
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_engine(args, webhook_url, storage_path):
+    serie = make_training_series(seed=42)
+    datos = window_features(serie, args.feature_window) if args.feature_window else serie.reshape(-1, 1)
+    model = RetunableIsolationForest(contamination=args.contamination, random_state=42).fit(datos)
+    simulator = FleetSimulator(args.sensors, seed=args.seed, failure_schedule=LIVE_FAILURE_SCHEDULE,
+                               failure_probabilities=LIVE_FAILURE_PROBABILITIES,
+                               recovery_probability=LIVE_RECOVERY_PROBABILITY)
+    storage_writer = StorageWriter(open_storage(args.storage, storage_path)).start() if args.storage else None
+    return SensorEngine(
+        simulator, {sensor_id: model for sensor_id in simulator.sensor_ids},
+        alert_dispatcher=AlertDispatcher(webhook_url).start(), history_capacity=args.history,
+        compiled_scorer=not args.no_compiled, storage_writer=storage_writer,
+        detector_bank=DetectorBank(args.sensors, default=tuple(args.detectors)) if args.detectors else None,
+        feature_extractor=SlidingWindowFeatures(args.sensors, args.feature_window) if args.feature_window else None,
+        metrics=MetricsRegistry() if args.metrics else None,
+        incident_tracker=IncidentTracker(args.sensors, resolve_after=args.resolve_after),
+    )
+
+
+def run_benchmark(args):
+    stub = start_webhook_stub()
+    webhook_url = f"http://127.0.0.1:{stub.server_address[1]}/webhook"
+    with tempfile.TemporaryDirectory() as directorio:
+        engine = build_engine(args, webhook_url, os.path.join(directorio, "lecturas.db" if args.storage == "sqlite" else "lecturas"))
+        for _ in range(args.warmup):
+            engine.tick()
+
+        rss_inicial = current_rss_bytes()
+        filas_iniciales = len(engine.history)
+        latencias = np.empty(args.ticks)
+        inicio = time.perf_counter()
+        for i in range(args.ticks):
+            t0 = time.perf_counter()
+            engine.tick()
+            latencias[i] = time.perf_counter() - t0
+        total = time.perf_counter() - inicio
+
+        engine.alert_dispatcher.stop()
+        if engine.storage_writer is not None:
+            engine.storage_writer.stop()
+            engine.storage_writer.storage.close()
+    stub.shutdown()
+
+    lecturas = args.sensors * args.ticks
+    alertas = engine.alert_dispatcher.metrics()
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'params': vars(args),
+        'results': {
+            'readings': lecturas,
+            'elapsed_s': total,
+            'readings_per_s': lecturas / total,
+            'tick_latency_ms': {
+                'mean': float(latencias.mean() * 1e3),
+                'p50': float(np.percentile(latencias, 50) * 1e3),
+                'p99': float(np.percentile(latencias, 99) * 1e3),
+                'max': float(latencias.max() * 1e3),
+            },
+            'peak_rss_bytes': peak_rss_bytes(),
+            'rss_growth_bytes': current_rss_bytes() - rss_inicial,
+            'history_rows': len(engine.history),
+            'history_rows_growth': len(engine.history) - filas_iniciales,
+            'history_bytes': engine.history.nbytes,
+            # El historial está preasignado: su tamaño no crece con las lecturas, así que se
+            # compara el costo por fila guardada (incluye la copia doble del anillo).
+            'history_bytes_per_row': engine.history.nbytes / engine.history.capacity,
+            'anomalies_detected': engine.total_anomalies_detected,
+            'incidents_opened': engine.incidents.totals[INCIDENT_OPENED],
+            'incidents_resolved': engine.incidents.totals[INCIDENT_RESOLVED],
+            'alerts_sent': alertas['sent_alerts'],
+            'alerts_dropped': alertas['dropped'],
+            'webhook_requests': _WebhookStub.requests_received,
+            'rows_stored': engine.storage_writer.rows_written if engine.storage_writer is not None else 0,
+            'stages': engine.metrics.stage_summary() if engine.metrics is not None else None,
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sin interfaz del ciclo de sensores.")
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=500)
+    parser.add_argument("--history", type=int, default=50_000, help="capacidad del historial en memoria")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--contamination", type=float, default=0.03)
+    parser.add_argument("--resolve-after", type=float, default=RESOLVE_AFTER_SECONDS,
+                        help="segundos sin anomalías para dar un incidente por resuelto")
+    parser.add_argument("--detectors", nargs="*", default=["flatline", "rate_of_change"])
+    parser.add_argument("--feature-window", type=int, default=None)
+    parser.add_argument("--storage", choices=["sqlite", "parquet"], default=None)
+    parser.add_argument("--metrics", action="store_true", help="registra la latencia por etapa del motor")
+    parser.add_argument("--no-compiled", action="store_true", help="usa el IsolationForest de sklearn sin compilar")
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    resultado = run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(resultado, f, indent=2)
+    r = resultado['results']
+    print(f"{r['readings_per_s']:,.0f} lecturas/s | tick p50 {r['tick_latency_ms']['p50']:.2f} ms "
+          f"p99 {r['tick_latency_ms']['p99']:.2f} ms | RSS pico {r['peak_rss_bytes'] / 2**20:.1f} MiB | "
+          f"historial {r['history_bytes'] / 2**20:.1f} MiB ({r['history_bytes_per_row']:.0f} B/fila) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
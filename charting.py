@@ -0,0 +1,78 @@
+import numpy as np
+
+from history_store import STATUS_ANOMALY
+
+
+def minmax_indices(sensor, x, y, n_buckets):
+    # Divide el eje x en n_buckets intervalos iguales y conserva el mínimo y el máximo
+    # de cada (sensor, intervalo): todos los sensores en una sola pasada vectorizada.
+    n = len(x)
+    if n == 0:
+        return np.empty(0, dtype=np.intp)
+    x0 = x.min()
+    span = x.max() - x0
+    if span <= 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((x - x0) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    key = sensor.astype(np.int64) * n_buckets + bucket
+    order = np.lexsort((y, key))
+    ordered_keys = key[order]
+    first = np.flatnonzero(np.r_[True, ordered_keys[1:] != ordered_keys[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate([order[first], order[last]]))
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets para una sola serie ordenada por x.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def decimate_indices(columns, max_points_per_sensor=300, max_anomaly_points_per_sensor=150, method="minmax"):
+    # Índices de las filas a dibujar: la serie de cada sensor reducida a ~max_points_per_sensor
+    # puntos conservando su forma, más los puntos anómalos (también acotados si exceden su
+    # presupuesto), de modo que el tamaño del cuadro no depende del largo de la ventana.
+    sensor = columns['sensor']
+    x = columns['timestamp']
+    y = columns['value']
+    n = len(x)
+    if n == 0:
+        return np.empty(0, dtype=np.intp)
+    sensors_in_window = np.unique(sensor)
+    if n <= max_points_per_sensor * len(sensors_in_window):
+        return np.arange(n)
+
+    if method == "lttb":
+        keep = []
+        for sensor_idx in sensors_in_window:
+            rows = np.flatnonzero(sensor == sensor_idx)
+            keep.append(rows[lttb_indices(x[rows], y[rows], max_points_per_sensor)])
+        line_idx = np.concatenate(keep)
+    elif method == "minmax":
+        line_idx = minmax_indices(sensor, x, y, max(1, max_points_per_sensor // 2))
+    else:
+        raise ValueError(f"Método de reducción desconocido: {method}")
+
+    anomaly_idx = np.flatnonzero(columns['status'] == STATUS_ANOMALY)
+    if len(anomaly_idx) > max_anomaly_points_per_sensor * len(sensors_in_window):
+        anomaly_idx = anomaly_idx[minmax_indices(
+            sensor[anomaly_idx], x[anomaly_idx], y[anomaly_idx], max(1, max_anomaly_points_per_sensor // 2)
+        )]
+    return np.union1d(line_idx, anomaly_idx)
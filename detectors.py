@@ -0,0 +1,193 @@
+import numpy as np
+
+
+def occurrence_rounds(sensor):
+    # Divide un lote en rondas donde cada sensor aparece a lo sumo una vez, respetando el
+    # orden de llegada, para que las actualizaciones de estado por sensor sean secuenciales.
+    n = len(sensor)
+    if n == 0:
+        return []
+    orden = np.argsort(sensor, kind='stable')
+    ordenados = sensor[orden]
+    inicio_grupo = np.r_[True, ordenados[1:] != ordenados[:-1]]
+    posicion_grupo = np.maximum.accumulate(np.where(inicio_grupo, np.arange(n), 0))
+    ocurrencia = np.empty(n, dtype=np.intp)
+    ocurrencia[orden] = np.arange(n) - posicion_grupo
+    rondas = int(ocurrencia.max()) + 1
+    if rondas == 1:
+        return [np.arange(n)]
+    por_ronda = np.argsort(ocurrencia, kind='stable')
+    return np.split(por_ronda, np.searchsorted(ocurrencia[por_ronda], np.arange(1, rondas)))
+
+
+class StreamingDetector:
+    # Detector en línea con estado por sensor en arreglos: update() recibe lecturas de
+    # sensores distintos y devuelve qué lecturas son anómalas, en O(1) por lectura.
+    name = "base"
+
+    def __init__(self, n_sensors):
+        self.n_sensors = n_sensors
+
+    def update(self, sensor, values, timestamps):
+        raise NotImplementedError
+
+    def update_batch(self, sensor, values, timestamps):
+        anomala = np.zeros(len(values), dtype=bool)
+        for filas in occurrence_rounds(sensor):
+            anomala[filas] = self.update(sensor[filas], values[filas], timestamps[filas])
+        return anomala
+
+
+class EWMAZScoreDetector(StreamingDetector):
+    name = "ewma"
+
+    def __init__(self, n_sensors, alpha=0.05, threshold=4.0, warmup=20, freeze_on_anomaly=True):
+        super().__init__(n_sensors)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.freeze_on_anomaly = freeze_on_anomaly
+        self.mean = np.zeros(n_sensors)
+        self.var = np.zeros(n_sensors)
+        self.count = np.zeros(n_sensors, dtype=np.int64)
+
+    def update(self, sensor, values, timestamps):
+        media = self.mean[sensor]
+        varianza = self.var[sensor]
+        cuenta = self.count[sensor]
+        diferencia = values - media
+        z = np.abs(diferencia) / np.sqrt(varianza + 1e-12)
+        anomala = (cuenta >= self.warmup) & (z > self.threshold)
+        actualizar = ~anomala if self.freeze_on_anomaly else np.ones(len(values), dtype=bool)
+        primera = cuenta == 0
+        incremento = self.alpha * diferencia
+        nueva_media = np.where(primera, values, media + incremento)
+        nueva_varianza = np.where(primera, 0.0, (1 - self.alpha) * (varianza + diferencia * incremento))
+        self.mean[sensor] = np.where(actualizar, nueva_media, media)
+        self.var[sensor] = np.where(actualizar, nueva_varianza, varianza)
+        self.count[sensor] = cuenta + actualizar
+        return anomala
+
+
+class RollingMADDetector(StreamingDetector):
+    # Mediana y MAD sobre una ventana circular fija por sensor (costo constante por lectura).
+    name = "mad"
+
+    def __init__(self, n_sensors, window=31, threshold=5.0, min_samples=10):
+        super().__init__(n_sensors)
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.buffer = np.full((n_sensors, window), np.nan)
+        self.position = np.zeros(n_sensors, dtype=np.int64)
+        self.count = np.zeros(n_sensors, dtype=np.int64)
+
+    def update(self, sensor, values, timestamps):
+        ventana = self.buffer[sensor]
+        listos = self.count[sensor] >= self.min_samples
+        anomala = np.zeros(len(values), dtype=bool)
+        if listos.any():
+            ventana_lista = ventana[listos]
+            mediana = np.nanmedian(ventana_lista, axis=1)
+            mad = np.nanmedian(np.abs(ventana_lista - mediana[:, None]), axis=1)
+            anomala[listos] = np.abs(values[listos] - mediana) > self.threshold * (1.4826 * mad + 1e-9)
+        self.buffer[sensor, self.position[sensor]] = values
+        self.position[sensor] = (self.position[sensor] + 1) % self.window
+        self.count[sensor] += 1
+        return anomala
+
+
+class FlatlineDetector(StreamingDetector):
+    # Sensor trabado: `window` o más lecturas seguidas dentro de una banda de max_range. Se
+    # lleva el mínimo y el máximo de la racha actual (O(1) por lectura); una lectura que
+    # ensancha la banda más allá de max_range empieza una racha nueva. Con la banda (y no la
+    # distancia al primer valor) un valor que oscila en un rango angosto, como el fallo
+    # simulado 22-24 °C, también se detecta; lecturas normales (σ = 2) casi nunca quedan 10
+    # seguidas dentro de 2 °C.
+    name = "flatline"
+
+    def __init__(self, n_sensors, window=10, max_range=2.0):
+        super().__init__(n_sensors)
+        self.max_range = max_range
+        self.window = window
+        self.run_min = np.full(n_sensors, np.nan)
+        self.run_max = np.full(n_sensors, np.nan)
+        self.run_length = np.zeros(n_sensors, dtype=np.int64)
+
+    def update(self, sensor, values, timestamps):
+        minimo = np.fmin(self.run_min[sensor], values)
+        maximo = np.fmax(self.run_max[sensor], values)
+        sigue = maximo - minimo <= self.max_range
+        racha = np.where(sigue, self.run_length[sensor] + 1, 1)
+        self.run_min[sensor] = np.where(sigue, minimo, values)
+        self.run_max[sensor] = np.where(sigue, maximo, values)
+        self.run_length[sensor] = racha
+        return racha >= self.window
+
+
+class RateOfChangeDetector(StreamingDetector):
+    # Salto entre lecturas consecutivas mayor a max_delta (o a max_delta_per_s por segundo).
+    name = "rate_of_change"
+
+    def __init__(self, n_sensors, max_delta=12.0, max_delta_per_s=None):
+        super().__init__(n_sensors)
+        self.max_delta = max_delta
+        self.max_delta_per_s = max_delta_per_s
+        self.last_value = np.full(n_sensors, np.nan)
+        self.last_timestamp = np.full(n_sensors, np.nan)
+
+    def update(self, sensor, values, timestamps):
+        delta = np.abs(values - self.last_value[sensor])
+        if self.max_delta_per_s is not None:
+            dt = np.maximum(timestamps - self.last_timestamp[sensor], 1e-3)
+            anomala = delta / dt > self.max_delta_per_s
+        else:
+            anomala = delta > self.max_delta
+        self.last_value[sensor] = values
+        self.last_timestamp[sensor] = timestamps
+        return anomala
+
+
+DETECTOR_TYPES = {
+    EWMAZScoreDetector.name: EWMAZScoreDetector,
+    RollingMADDetector.name: RollingMADDetector,
+    FlatlineDetector.name: FlatlineDetector,
+    RateOfChangeDetector.name: RateOfChangeDetector,
+}
+
+
+class DetectorBank:
+    # Conjunto de detectores en línea con selección por sensor: assignments mapea índice de
+    # sensor -> nombres de detector; los sensores sin entrada usan default.
+
+    def __init__(self, n_sensors, default=("flatline", "rate_of_change"), assignments=None, params=None):
+        params = params or {}
+        nombres = list(dict.fromkeys(list(default) + [nombre for lista in (assignments or {}).values() for nombre in lista]))
+        desconocidos = [nombre for nombre in nombres if nombre not in DETECTOR_TYPES]
+        if desconocidos:
+            raise ValueError(f"Detectores desconocidos: {desconocidos}")
+        self.detectors = [DETECTOR_TYPES[nombre](n_sensors, **params.get(nombre, {})) for nombre in nombres]
+        self.enabled = np.zeros((n_sensors, len(nombres)), dtype=bool)
+        for j, nombre in enumerate(nombres):
+            self.enabled[:, j] = nombre in default
+        for sensor_idx, lista in (assignments or {}).items():
+            self.enabled[sensor_idx] = [nombre in lista for nombre in nombres]
+        self.hits = np.zeros(len(nombres), dtype=np.int64)
+
+    @property
+    def names(self):
+        return [detector.name for detector in self.detectors]
+
+    def update(self, sensor, values, timestamps):
+        sensor = np.asarray(sensor, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), len(values))
+        anomala = np.zeros(len(values), dtype=bool)
+        for j, detector in enumerate(self.detectors):
+            filas = np.flatnonzero(self.enabled[sensor, j])
+            if filas.size == 0:
+                continue
+            resultado = detector.update_batch(sensor[filas], values[filas], timestamps[filas])
+            self.hits[j] += int(np.count_nonzero(resultado))
+            anomala[filas[resultado]] = True
+        return anomala
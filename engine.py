@@ -0,0 +1,478 @@
+import threading
+import time
+
+import numpy as np
+
+from alerts import build_digest_embed, build_incident_embed
+from history_store import HistoryStore, ANOMALY_TYPE_LABELS, STATUS_ANOMALY, STATUS_LABELS, STATUS_NORMAL
+from incidents import (DIGEST_THRESHOLD, INCIDENT_ESCALATED, INCIDENT_OPENED, INCIDENT_RESOLVED, IncidentTracker,
+                       split_digests)
+from metrics import null_timer
+from scoring import BatchScorer
+from simulation import FAILURE_TYPE_LABELS, PERSISTENT_CODE_OFFSET
+from storage import concat_columns
+
+FAILURE_SUGGESTIONS = {
+    "Pico Alto": "Revisar posibles sobrecargas, fallos en ventilación o componentes sobrecalentados.",
+    "Caída Baja": "Verificar si el sensor está desconectado, dañado o hay un problema en la fuente de energía.",
+    "Valor Constante": "Inspeccionar el sensor por posibles fallas de congelación, cortocircuito o falta de comunicación.",
+}
+
+
+class SensorEngine:
+    # Genera, evalúa y almacena lecturas en un hilo propio a su ritmo (interval),
+    # independiente de cuántas sesiones de Streamlit lo estén dibujando.
+
+    def __init__(self, simulator, sensor_models, alert_dispatcher=None, interval=0.5,
+                 history_capacity=50_000, incident_tracker=None, digest_threshold=DIGEST_THRESHOLD, compiled_scorer=True,
+                 tz=None, storage_writer=None, detector_bank=None, feature_extractor=None,
+                 metrics=None, event_time=False, sensor_ids=None, rollups=None, contamination=None):
+        # simulator puede ser None (solo ingesta externa o reproducción); entonces los
+        # sensores salen de sensor_ids o, si no se dan, de las claves de sensor_models.
+        self.simulator = simulator
+        self.sensor_ids = list(simulator.sensor_ids if simulator is not None else sensor_ids or sensor_models)
+        self._sensor_index = np.arange(len(self.sensor_ids))
+        self.sensor_models = dict(sensor_models)
+        self.compiled_scorer = compiled_scorer
+        self.scorer = BatchScorer(self.sensor_models, self.sensor_ids, compiled=compiled_scorer)
+        self.history = HistoryStore(self.sensor_ids, capacity=history_capacity)
+        self.alert_dispatcher = alert_dispatcher
+        self.storage_writer = storage_writer
+        # Lecturas guardadas por (sensor, estado, tipo de anomalía): se cuentan en disco una vez
+        # al arrancar y se suman con cada lote, así el total de una página sin rango de tiempo
+        # no hace COUNT(*). _page_cursors recuerda la clave final de las páginas leídas del disco.
+        self._stored_counts = None
+        self._page_cursors = {}
+        self._newest_stored = -np.inf
+        # Hora más nueva que ya estaba en disco al arrancar: mientras el anillo no dé la vuelta,
+        # toda lectura posterior a ella está en memoria.
+        self._stored_until = -np.inf
+        if storage_writer is not None:
+            ultima = storage_writer.storage.query(columns=('timestamp',), limit=1, newest_first=True)['timestamp']
+            if len(ultima):
+                self._stored_until = float(ultima[0])
+            self._stored_counts = np.zeros((len(self.sensor_ids), len(STATUS_LABELS), len(ANOMALY_TYPE_LABELS)),
+                                           dtype=np.int64)
+            guardadas = storage_writer.storage.count_by_code()
+            validas = guardadas['sensor'] < len(self.sensor_ids)
+            np.add.at(self._stored_counts, tuple(guardadas[name][validas] for name in ('sensor', 'status', 'anomaly_type')),
+                      guardadas['count'][validas])
+        self.detector_bank = detector_bank
+        self.feature_extractor = feature_extractor
+        self.metrics = metrics
+        # Agregados por tier (p. ej. 10 s / 1 min / 1 h) para las vistas largas.
+        self.rollups = rollups
+        self.rollups_backfilling = False
+        self._timer = null_timer if metrics is None else metrics.timer
+        if metrics is not None:
+            metrics.register_gauge("history_rows", lambda: len(self.history))
+            metrics.register_gauge("history_bytes", lambda: self.history.nbytes)
+            if alert_dispatcher is not None:
+                metrics.register_gauge("alert_queue_depth", lambda: alert_dispatcher.metrics()['queue_depth'])
+            if storage_writer is not None:
+                metrics.register_gauge("storage_rows_written", lambda: storage_writer.rows_written)
+            if rollups is not None:
+                metrics.register_gauge("rollup_bytes", lambda: rollups.nbytes)
+        self.interval = interval
+        # Las alertas salen de los incidentes (uno abierto por sensor): se notifica al abrir,
+        # escalar y resolver, no por cada lectura anómala.
+        self.incidents = IncidentTracker(len(self.sensor_ids)) if incident_tracker is None else incident_tracker
+        self.digest_threshold = digest_threshold
+        if metrics is not None:
+            metrics.register_gauge("open_incidents", lambda: self.incidents.open_count)
+        self.tz = tz
+        self.lock = threading.RLock()
+        # event_time=True mide los incidentes con la hora de las lecturas (reproducción de
+        # datos históricos) en lugar del reloj de pared.
+        self.event_time = event_time
+        self.anomaly_counts = np.zeros(len(self.sensor_ids), dtype=np.int64)
+        self.total_anomalies_detected = 0
+        self.total_alerts_sent = 0
+        self.displayed_alert_message = ""
+        self.displayed_suggestion_message = ""
+        self.any_sensor_failed = False
+        self.tick_count = 0
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread = None
+        # Los modelos pueden venir con contaminaciones distintas (versiones del registro fijadas
+        # o revertidas, modelo compartido): toda la flota arranca con la misma.
+        self.set_contamination(self.contamination if contamination is None else contamination)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sensor-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def contamination(self):
+        return next(iter(self.sensor_models.values())).contamination
+
+    def set_interval(self, interval):
+        self.interval = float(interval)
+
+    @property
+    def feature_window(self):
+        return None if self.feature_extractor is None else self.feature_extractor.window
+
+    def set_contamination(self, contamination):
+        with self.lock:
+            modelos_unicos = {id(model): model for model in self.sensor_models.values()}
+            for model in modelos_unicos.values():
+                model.set_contamination(contamination)
+            self.scorer.refresh_thresholds()
+
+    def swap_models(self, sensor_models):
+        # Reemplaza los modelos de los sensores dados. El scorer nuevo se construye (y
+        # compila) fuera del lock; la ingesta solo espera la asignación final. Si otro
+        # intercambio (reentrenamiento, fijar/revertir desde la UI) cambió los modelos
+        # mientras tanto, se vuelve a combinar sobre los actuales para no pisarlo.
+        while True:
+            base = self.sensor_models
+            modelos = dict(base)
+            modelos.update(sensor_models)
+            scorer = BatchScorer(modelos, self.sensor_ids, compiled=self.compiled_scorer, dedupe=False)
+            with self.lock:
+                if self.sensor_models is not base:
+                    continue
+                contamination = self.contamination
+                for model in {id(model): model for model in sensor_models.values()}.values():
+                    if model.contamination != contamination:
+                        model.set_contamination(contamination)
+                scorer.refresh_thresholds()
+                self.sensor_models = modelos
+                self.scorer = scorer
+                return
+
+    def sensor_windows(self, window, exclude_anomalies=True):
+        # Últimas `window` lecturas de cada sensor en el historial en memoria (sin las
+        # marcadas como anómalas si exclude_anomalies), para reentrenar sus modelos.
+        with self.lock:
+            columns = self.history.tail()
+            sensor = columns['sensor'].copy()
+            values = columns['value'].copy()
+            normales = columns['status'] == STATUS_NORMAL if exclude_anomalies else None
+        if normales is not None:
+            sensor, values = sensor[normales], values[normales]
+        orden = np.argsort(sensor, kind='stable')
+        sensor, values = sensor[orden], values[orden]
+        cortes = np.searchsorted(sensor, np.arange(len(self.sensor_ids) + 1))
+        return {
+            sensor_id: values[max(cortes[idx], cortes[idx + 1] - window):cortes[idx + 1]]
+            for idx, sensor_id in enumerate(self.sensor_ids)
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            inicio = time.monotonic()
+            self.tick()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - inicio)))
+
+    def tick(self):
+        with self.lock, self._timer("tick"):
+            with self._timer("generate"):
+                values, anomaly_codes, failed = self.simulator.tick()
+            self.process(time.time(), values, anomaly_codes, failed)
+
+    def process(self, tick_timestamp, values, anomaly_codes, failed):
+        self.process_readings(self._sensor_index, tick_timestamp, values, anomaly_codes, failed)
+
+    def process_readings(self, sensor, timestamps, values, anomaly_codes=None, failed=None):
+        # Punto de entrada común del simulador y de la ingesta por red: lecturas de cualquier
+        # subconjunto de sensores. Sin estado de fallo conocido (sensores reales) se toma
+        # la detección del modelo como estado.
+        sensor = np.asarray(sensor, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        anomaly_codes = np.zeros(n, dtype=np.int8) if anomaly_codes is None else np.asarray(anomaly_codes, dtype=np.int8)
+        with self.lock:
+            self.tick_count += 1
+            timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), n)
+            with self._timer("score"):
+                entradas = values if self.feature_extractor is None else self.feature_extractor.update(sensor, values)
+                predicciones = self.scorer.predict_readings(sensor, entradas)
+            detectada = predicciones == -1
+            if self.detector_bank is not None:
+                with self._timer("detect"):
+                    detectada |= self.detector_bank.update(sensor, values, timestamps)
+            failed = detectada if failed is None else np.asarray(failed, dtype=bool)
+            anomala = detectada | failed
+            detectadas = int(np.count_nonzero(detectada))
+            self.total_anomalies_detected += detectadas
+            self.anomaly_counts += np.bincount(sensor[detectada], minlength=len(self.sensor_ids))
+
+            with self._timer("alert"):
+                if self.event_time:
+                    eventos = self.incidents.update(sensor, timestamps, values, anomaly_codes, detectada, float(timestamps.max()))
+                else:
+                    current_time = time.time()
+                    eventos = self.incidents.update(sensor, np.full(n, current_time), values, anomaly_codes, detectada, current_time)
+                notificaciones = self._notify(eventos) if eventos else 0
+
+            with self._timer("store"):
+                estados = np.where(anomala, STATUS_ANOMALY, STATUS_NORMAL).astype(np.int8)
+                # El historial se guarda por clave (hora, sensor): un lote de la ingesta con
+                # sensores en cualquier orden dentro de una hora se reordena al guardarlo.
+                desorden = (timestamps[1:] < timestamps[:-1]) | ((timestamps[1:] == timestamps[:-1]) & (sensor[1:] < sensor[:-1]))
+                if desorden.any():
+                    orden = np.lexsort((sensor, timestamps))
+                    self.history.extend(timestamps[orden], sensor[orden], values[orden], estados[orden], anomaly_codes[orden])
+                else:
+                    self.history.extend(timestamps, sensor, values, estados, anomaly_codes)
+                if self.rollups is not None:
+                    self.rollups.update(sensor, timestamps, values, anomala)
+                if self.storage_writer is not None:
+                    np.add.at(self._stored_counts, (sensor, estados, anomaly_codes), 1)
+                    # Lecturas atrasadas cambian cuántas coincidencias hay antes de cada cursor.
+                    if timestamps.min() <= self._newest_stored:
+                        self._page_cursors.clear()
+                    self._newest_stored = max(self._newest_stored, float(timestamps.max()))
+                    self.storage_writer.submit({
+                        'timestamp': timestamps,
+                        'sensor': sensor,
+                        'value': values,
+                        'status': estados,
+                        'anomaly_type': anomaly_codes,
+                    })
+            if self.metrics is not None:
+                self.metrics.inc("readings_total", n)
+                self.metrics.inc("anomalies_total", detectadas)
+                self.metrics.inc("alerts_triggered_total", notificaciones)
+                for kind in (INCIDENT_OPENED, INCIDENT_ESCALATED, INCIDENT_RESOLVED):
+                    total = sum(1 for evento in eventos if evento['event'] == kind)
+                    if total:
+                        self.metrics.inc(f"incidents_{kind}_total", total)
+
+            self.any_sensor_failed = bool(failed.any())
+            if self.any_sensor_failed:
+                anomalas = np.flatnonzero(anomala)
+                if anomalas.size:
+                    idx = anomalas[-1]
+                    sensor_id = self.sensor_ids[sensor[idx]]
+                    self.displayed_alert_message = (f"🚨 **¡ALERTA!** Se ha detectado una **ANOMALÍA** "
+                                                    f"({ANOMALY_TYPE_LABELS[anomaly_codes[idx]]}) en el sensor **{sensor_id}**: **{values[idx]:.2f}°C**. "
+                                                    f"¡Se recomienda revisar el sistema!")
+                    self.displayed_suggestion_message = (f"💡 **Sugerencia de Acción para {sensor_id}:** {self._suggestion(anomaly_codes[idx])}")
+            else:
+                self.displayed_alert_message = ""
+                self.displayed_suggestion_message = ""
+
+    def _suggestion(self, anomaly_code):
+        tipo = int(anomaly_code)
+        if tipo > PERSISTENT_CODE_OFFSET:
+            tipo -= PERSISTENT_CODE_OFFSET
+        return FAILURE_SUGGESTIONS.get(FAILURE_TYPE_LABELS[tipo], "")
+
+    def _notify(self, eventos):
+        # Cada evento va como un embed; si muchos sensores abren (o resuelven) incidentes
+        # en el mismo lote, esos se resumen en un único mensaje de flota. Devuelve cuántos
+        # mensajes se generaron.
+        individuales, resumenes = split_digests(eventos, self.digest_threshold)
+        embeds = [
+            build_incident_embed(evento, self.sensor_ids[evento['sensor']], ANOMALY_TYPE_LABELS[evento['anomaly_type']],
+                                 self._suggestion(evento['anomaly_type']), tz=self.tz)
+            for evento in individuales
+        ]
+        embeds.extend(
+            build_digest_embed(kind, [(self.sensor_ids[evento['sensor']], ANOMALY_TYPE_LABELS[evento['anomaly_type']], evento)
+                                      for evento in grupo], tz=self.tz)
+            for kind, grupo in resumenes
+        )
+        if self.alert_dispatcher is not None:
+            for embed in embeds:
+                if self.alert_dispatcher.submit(embed):
+                    self.total_alerts_sent += 1
+        return len(embeds)
+
+    def snapshot(self):
+        # Todas las sesiones leen el mismo diccionario mientras no haya un lote nuevo; se
+        # reconstruye una vez por lote, no una vez por sesión. No debe modificarse.
+        with self.lock:
+            if self._snapshot is None or self._snapshot['tick_count'] != self.tick_count:
+                self._snapshot = self._build_snapshot()
+            return self._snapshot
+
+    def _build_snapshot(self):
+        return {
+            'version': self.history.total_appended,
+            'tick_count': self.tick_count,
+            'total_anomalies_detected': self.total_anomalies_detected,
+            'total_alerts_sent': self.total_alerts_sent,
+            'any_sensor_failed': self.any_sensor_failed,
+            'displayed_alert_message': self.displayed_alert_message,
+            'displayed_suggestion_message': self.displayed_suggestion_message,
+            'open_incidents': self.incidents.open_count,
+            'incident_totals': dict(self.incidents.totals),
+            'incidents': self.incidents.open_incidents(limit=20),
+            'detector_hits': {} if self.detector_bank is None else dict(zip(self.detector_bank.names, self.detector_bank.hits.tolist())),
+        }
+
+    def _ring_has_window(self, start):
+        # El historial en memoria tiene todas las lecturas desde `start`: el anillo no ha dado
+        # la vuelta y el disco no tenía lecturas desde esa hora, o `start` no es anterior a la
+        # lectura más antigua del anillo.
+        if self.history.total_appended <= self.history.capacity and start > self._stored_until:
+            return True
+        return len(self.history) > 0 and start >= self.history.oldest_timestamp()
+
+    def _needs_storage(self, start):
+        # La ventana caliente en memoria alcanza si tiene todas las lecturas desde el inicio
+        # pedido; si no, la consulta va al almacenamiento en disco.
+        if self.storage_writer is None:
+            return False
+        return start is None or not self._ring_has_window(start)
+
+    def history_window(self, seconds=None, n=None):
+        start = None if seconds is None else time.time() - seconds
+        with self.lock:
+            if seconds is None or not self._needs_storage(start):
+                columns = self.history.tail(n) if seconds is None else self.history.since(start)
+                return {name: column.copy() for name, column in columns.items()}
+        self.storage_writer.flush()
+        return self.storage_writer.storage.query(start=start)
+
+    def rollup_window(self, seconds, max_points):
+        # (resolución, buckets) del tier que cubre los últimos `seconds` con cerca de
+        # max_points buckets por sensor. None si conviene leer lecturas crudas: el historial
+        # en memoria tiene la ventana completa y el tier más fino daría menos de max_points
+        # buckets (o hay pocas lecturas), o los agregados empezaron después del inicio pedido
+        # y el disco sí tiene esas lecturas. Mientras backfill_rollups corre se devuelven los
+        # agregados parciales (rollups_backfilling) en lugar de leer crudo del disco.
+        start = time.time() - seconds
+        with self.lock:
+            if self.rollups is None or self.rollups.first_timestamp is None:
+                return None
+            if self._ring_has_window(start) and (seconds / self.rollups.tiers[0].resolution < max_points
+                                                 or len(self.history.since(start)['value']) <= max_points * len(self.sensor_ids)):
+                return None
+            if self.storage_writer is not None and self.rollups.first_timestamp > start and not self.rollups_backfilling:
+                return None
+            tier = self.rollups.pick(seconds, max_points)
+            return tier.resolution, tier.window(start)
+
+    def start_rollup_backfill(self, until):
+        self.rollups_backfilling = True
+        threading.Thread(target=self.backfill_rollups, args=(until,), name="rollup-backfill", daemon=True).start()
+
+    def backfill_rollups(self, until, chunk_seconds=3600):
+        # Carga en los agregados las lecturas guardadas en disco anteriores a `until` (el
+        # arranque del motor) dentro de la retención de los tiers, por tramos de
+        # chunk_seconds. Puede correr en otro hilo: el lock se toma solo por tramo y los
+        # agregados no dependen del orden en que llegan las lecturas.
+        if self.rollups is None or self.storage_writer is None:
+            self.rollups_backfilling = False
+            return 0
+        self.rollups_backfilling = True
+        try:
+            storage = self.storage_writer.storage
+            inicio = until - max(tier.retention for tier in self.rollups.tiers)
+            desde = inicio
+            total = 0
+            while desde < until:
+                hasta = min(desde + chunk_seconds, until)
+                columnas = storage.query(start=desde, end=hasta, columns=('timestamp', 'sensor', 'value', 'status'))
+                dentro = columnas['timestamp'] < hasta
+                with self.lock:
+                    self.rollups.update(columnas['sensor'][dentro], columnas['timestamp'][dentro], columnas['value'][dentro],
+                                        columnas['status'][dentro] == STATUS_ANOMALY)
+                total += int(np.count_nonzero(dentro))
+                desde = hasta
+            with self.lock:
+                primera = self.rollups.first_timestamp
+                self.rollups.first_timestamp = inicio if primera is None else min(primera, inicio)
+        finally:
+            self.rollups_backfilling = False
+        return total
+
+    def _stored_total(self, sensors=None, statuses=None, anomaly_types=None, **_):
+        conteo = self._stored_counts
+        for eje, permitidos in enumerate((sensors, statuses, anomaly_types)):
+            if permitidos is not None:
+                conteo = conteo.take(np.unique(np.asarray(permitidos, dtype=np.intp)), axis=eje)
+        return int(conteo.sum())
+
+    def _history_boundary(self):
+        # Clave (hora, sensor) de la lectura más antigua en memoria: con el anillo ordenado por
+        # clave (history.is_sorted), las de clave menor están solo en el disco.
+        columnas = self.history.tail()
+        hora = columnas['timestamp'][0]
+        mismas = int(np.searchsorted(columnas['timestamp'], hora, side='right'))
+        return float(hora), int(columnas['sensor'][:mismas].min())
+
+    def _stored_page(self, filters, before, offset, limit, stored_total):
+        # Filas del disco anteriores a `before`, saltando `offset`. Sin rango de tiempo, cuántas
+        # coincidencias son más antiguas que una clave no cambia: se guarda la última clave de
+        # cada página leída y la siguiente página arranca desde ella en lugar de usar OFFSET.
+        storage = self.storage_writer.storage
+        if stored_total is None:
+            return storage.query(limit=limit, offset=offset, newest_first=True, before=before, **filters)
+        clave = tuple(sorted(filters.items()))
+        with self.lock:
+            cursores = self._page_cursors.pop(clave, {})
+            self._page_cursors[clave] = cursores
+            if len(self._page_cursors) > 32:
+                del self._page_cursors[next(iter(self._page_cursors))]
+            # Cursor con rango < offset más cercano (anteriores = coincidencias más antiguas que él).
+            anteriores = min((n for n in cursores if n >= stored_total - offset), default=None)
+        desde, salto = before, offset
+        if anteriores is not None:
+            desde, salto = cursores[anteriores], offset - stored_total + anteriores
+        filas = storage.query(limit=limit, offset=salto, newest_first=True, before=desde, **filters)
+        leidas = len(filas['timestamp'])
+        if leidas:
+            with self.lock:
+                cursores[stored_total - offset - leidas] = (float(filas['timestamp'][-1]), int(filas['sensor'][-1]))
+                if len(cursores) > 1024:
+                    del cursores[next(iter(cursores))]
+        return filas
+
+    def history_page(self, page, page_size, **filters):
+        # Página (la más reciente primero) de las lecturas que cumplen el filtro, total de
+        # coincidencias y número de página efectivo (acotado a la última). Las lecturas más
+        # recientes están en memoria: una página que cae en ellas no toca el disco y el resto
+        # se pide al disco por clave (hora, sensor) desde la lectura más antigua en memoria.
+        start, end = filters.get('start'), filters.get('end')
+        with self.lock:
+            en_disco = self._needs_storage(start)
+            if not en_disco:
+                indices = self.history.query(**filters)
+                page = min(page, max(0, (len(indices) - 1) // page_size))
+                fin = len(indices) - page * page_size
+                return self.history.take(indices[max(0, fin - page_size):fin][::-1]), len(indices), page
+        sin_rango = start is None and end is None
+        if not sin_rango:
+            # Con rango de tiempo el total se cuenta en disco (incluye lo que está en memoria).
+            self.storage_writer.flush()
+            total = self.storage_writer.storage.count(**filters)
+        with self.lock:
+            indices = self.history.query(**filters)
+            if sin_rango:
+                total = self._stored_total(**filters)
+            borde = self._history_boundary() if self.history.is_sorted and len(self.history) else None
+            if borde is None:
+                # Con horas fuera de orden la memoria no es el tramo final por clave: todo sale del disco.
+                indices = indices[:0]
+            page = min(page, max(0, (total - 1) // page_size))
+            fin = len(indices) - page * page_size
+            recientes = self.history.take(indices[max(0, fin - page_size):max(0, fin)][::-1])
+        faltan = page_size - len(recientes['timestamp'])
+        if faltan <= 0 or total <= len(indices):
+            return recientes, total, page
+        # Los totales ya cuentan lo que el writer aún no escribió: se escribe antes de leer.
+        self.storage_writer.flush()
+        antiguas = self._stored_page(filters, borde, max(0, -fin), faltan,
+                                     total - len(indices) if sin_rango and borde is not None else None)
+        return concat_columns([recientes, antiguas]), total, page
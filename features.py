@@ -0,0 +1,82 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from detectors import occurrence_rounds
+
+FEATURE_NAMES = ("value", "mean", "std", "min", "max", "slope", "delta", "run_length")
+
+
+def _slope_weights(window):
+    t = np.arange(window, dtype=np.float64)
+    centrado = t - t.mean()
+    return centrado / (centrado ** 2).sum()
+
+
+def features_from_windows(windows, tolerance=0.0):
+    # windows: (m, w) en orden cronológico (la columna -1 es la lectura actual).
+    ultimo = windows[:, -1]
+    ancho = windows.shape[1]
+    iguales = np.abs(windows - ultimo[:, None]) <= tolerance
+    racha = np.cumprod(iguales[:, ::-1], axis=1).sum(axis=1)
+    return np.column_stack([
+        ultimo,
+        windows.mean(axis=1),
+        windows.std(axis=1),
+        windows.min(axis=1),
+        windows.max(axis=1),
+        windows @ _slope_weights(ancho) if ancho > 1 else np.zeros(len(ultimo)),
+        ultimo - windows[:, -2] if ancho > 1 else np.zeros(len(ultimo)),
+        racha,
+    ])
+
+
+def window_features(series, window, tolerance=0.0):
+    # Características de cada ventana que termina en cada lectura de una serie (o de cada
+    # fila de una matriz sensores x tiempo), con el inicio rellenado con la primera lectura
+    # igual que SlidingWindowFeatures durante el calentamiento.
+    series = np.asarray(series, dtype=np.float64)
+    if series.ndim == 1:
+        series = series[None, :]
+    relleno = np.repeat(series[:, :1], window - 1, axis=1)
+    ventanas = sliding_window_view(np.concatenate([relleno, series], axis=1), window, axis=1)
+    return features_from_windows(ventanas.reshape(-1, window), tolerance)
+
+
+class SlidingWindowFeatures:
+    # Ventana deslizante por sensor en un arreglo (n_sensors, window); update() inserta las
+    # lecturas del lote y calcula las características de todos esos sensores en una pasada.
+
+    def __init__(self, n_sensors, window=10, tolerance=0.0):
+        if window < 2:
+            raise ValueError("window debe ser al menos 2")
+        self.n_sensors = n_sensors
+        self.window = window
+        self.tolerance = tolerance
+        self.buffer = np.zeros((n_sensors, window))
+        self.position = np.zeros(n_sensors, dtype=np.int64)
+        self.started = np.zeros(n_sensors, dtype=bool)
+        self._offsets = np.arange(1, window + 1)
+
+    @property
+    def n_features(self):
+        return len(FEATURE_NAMES)
+
+    def _update_round(self, sensor, values):
+        nuevos = ~self.started[sensor]
+        if nuevos.any():
+            self.buffer[sensor[nuevos]] = values[nuevos, None]
+            self.started[sensor[nuevos]] = True
+        posicion = self.position[sensor]
+        self.buffer[sensor, posicion] = values
+        self.position[sensor] = (posicion + 1) % self.window
+        orden = (posicion[:, None] + self._offsets) % self.window
+        ventanas = np.take_along_axis(self.buffer[sensor], orden, axis=1)
+        return features_from_windows(ventanas, self.tolerance)
+
+    def update(self, sensor, values):
+        sensor = np.asarray(sensor, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        resultado = np.empty((len(values), self.n_features))
+        for filas in occurrence_rounds(sensor):
+            resultado[filas] = self._update_round(sensor[filas], values[filas])
+        return resultado
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+STATUS_NORMAL = 0
+STATUS_ANOMALY = 1
+STATUS_LABELS = ("Normal", "ANOMALÍA DETECTADA")
+
+ANOMALY_TYPE_LABELS = (
+    "N/A",
+    "Pico Alto",
+    "Caída Baja",
+    "Valor Constante",
+    "Pico Alto (Persistente)",
+    "Caída Baja (Persistente)",
+    "Valor Constante (Persistente)",
+)
+ANOMALY_TYPE_CODES = {label: code for code, label in enumerate(ANOMALY_TYPE_LABELS)}
+
+HISTORY_COLUMNS = ['Hora', 'Sensor ID', 'Lectura (°C)', 'Estado', 'Tipo de Anomalía']
+# Formato de las columnas al mostrarlas; se aplica solo a las celdas que se dibujan.
+HISTORY_DISPLAY_FORMATS = {'Hora': '{:%H:%M:%S}', 'Lectura (°C)': '{:.2f}'}
+
+
+def sensor_code_dtype(sensor_count):
+    # Código de sensor más chico que alcanza para la flota (int16 hasta 32767 sensores).
+    return np.int16 if sensor_count <= np.iinfo(np.int16).max else np.int32
+
+
+class HistoryStore:
+    # Cada columna se guarda dos veces (posición i e i + capacity) para que
+    # cualquier ventana de las últimas n lecturas sea un slice contiguo (vista sin copia).
+    # Por fila: hora epoch (float64, s), código de sensor, valor float32 y códigos int8.
+    # La hora queda en float64 y no en int64 porque así la reciben la ingesta, los rollups,
+    # el almacenamiento y las búsquedas por hora, sin conversiones; para horas epoch actuales
+    # float64 resuelve ~0,25 µs, más fino que cualquier lectura de la flota.
+
+    def __init__(self, sensor_ids, capacity=50_000):
+        if capacity <= 0:
+            raise ValueError("capacity debe ser mayor que cero")
+        self.sensor_ids = list(sensor_ids)
+        self.capacity = int(capacity)
+        self.sensor_labels = np.array(self.sensor_ids, dtype=object)
+        self._timestamp = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._sensor = np.zeros(2 * self.capacity, dtype=sensor_code_dtype(len(self.sensor_ids)))
+        self._value = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._status = np.zeros(2 * self.capacity, dtype=np.int8)
+        self._anomaly_type = np.zeros(2 * self.capacity, dtype=np.int8)
+        self._columns = {
+            'timestamp': self._timestamp,
+            'sensor': self._sensor,
+            'value': self._value,
+            'status': self._status,
+            'anomaly_type': self._anomaly_type,
+        }
+        self.total_appended = 0
+        # Secuencia hasta la que llegó el último lote fuera de orden por clave (hora, sensor),
+        # p. ej. horas enviadas por clientes de la ingesta. Mientras esas filas sigan en el
+        # anillo, las búsquedas por hora y el paginado por clave no pueden asumir orden.
+        self._disorder_until = -self.capacity
+
+    def __len__(self):
+        return min(self.total_appended, self.capacity)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    @property
+    def is_sorted(self):
+        return self.total_appended - self._disorder_until >= self.capacity
+
+    def _track_order(self, timestamps, sensor):
+        desordenado = np.any((timestamps[1:] < timestamps[:-1])
+                             | ((timestamps[1:] == timestamps[:-1]) & (sensor[1:] < sensor[:-1])))
+        if self.total_appended:
+            ultima = (self.total_appended - 1) % self.capacity
+            hora, previo = self._timestamp[ultima], self._sensor[ultima]
+            desordenado |= timestamps[0] < hora or (timestamps[0] == hora and sensor[0] < previo)
+        if desordenado:
+            self._disorder_until = self.total_appended + len(timestamps)
+
+    def oldest_timestamp(self):
+        timestamps = self.tail()['timestamp']
+        if len(timestamps) == 0:
+            return None
+        return timestamps[0] if self.is_sorted else timestamps.min()
+
+    def extend(self, timestamp, sensor, value, status, anomaly_type):
+        sensor = np.asarray(sensor)
+        n = sensor.shape[0]
+        if n == 0:
+            return
+        values = {
+            'timestamp': np.broadcast_to(timestamp, n),
+            'sensor': sensor,
+            'value': np.broadcast_to(value, n),
+            'status': np.broadcast_to(status, n),
+            'anomaly_type': np.broadcast_to(anomaly_type, n),
+        }
+        self._track_order(values['timestamp'], sensor)
+        if n > self.capacity:
+            values = {name: column[-self.capacity:] for name, column in values.items()}
+            self.total_appended += n - self.capacity
+            n = self.capacity
+        slots = (self.total_appended + np.arange(n)) % self.capacity
+        for name, column in self._columns.items():
+            column[slots] = values[name]
+            column[slots + self.capacity] = values[name]
+        self.total_appended += n
+
+    def tail(self, n=None):
+        size = len(self)
+        n = size if n is None else max(0, min(int(n), size))
+        end = self.total_appended % self.capacity + self.capacity
+        return {name: column[end - n:end] for name, column in self._columns.items()}
+
+    def since(self, timestamp):
+        columns = self.tail()
+        if not self.is_sorted:
+            mask = columns['timestamp'] >= timestamp
+            return {name: column[mask] for name, column in columns.items()}
+        start = np.searchsorted(columns['timestamp'], timestamp, side='left')
+        return {name: column[start:] for name, column in columns.items()}
+
+    def query(self, sensors=None, statuses=None, anomaly_types=None, start=None, end=None):
+        # Índices (relativos a tail()) de las lecturas que cumplen el filtro; el rango de
+        # tiempo se resuelve con búsqueda binaria (o con máscara si hay filas fuera de orden)
+        # y el resto con máscaras sobre los códigos.
+        columns = self.tail()
+        timestamps = columns['timestamp']
+        if self.is_sorted:
+            lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+            hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+            mask = np.ones(max(0, hi - lo), dtype=bool)
+        else:
+            lo, hi = 0, len(timestamps)
+            mask = np.ones(hi, dtype=bool)
+            if start is not None:
+                mask &= timestamps >= start
+            if end is not None:
+                mask &= timestamps <= end
+        for name, allowed in (('sensor', sensors), ('status', statuses), ('anomaly_type', anomaly_types)):
+            if allowed is not None:
+                mask &= np.isin(columns[name][lo:hi], np.asarray(allowed))
+        return lo + np.flatnonzero(mask)
+
+    def take(self, indices):
+        return {name: column[indices] for name, column in self.tail().items()}
+
+
+def columns_to_dataframe(columns, sensor_labels, tz=None):
+    # Sensor, estado y tipo quedan como categóricas sobre los códigos (sin un string por
+    # fila) y la hora como datetime en la hora local de tz, así los gráficos la tratan como
+    # tiempo (ordenada también al cruzar la medianoche). El texto para mostrar lo pone
+    # HISTORY_DISPLAY_FORMATS sobre las filas visibles.
+    horas = pd.to_datetime(columns['timestamp'], unit='s', utc=True)
+    if tz is not None:
+        horas = horas.tz_convert(tz)
+    return pd.DataFrame({
+        'Hora': horas.tz_localize(None),
+        'Sensor ID': pd.Categorical.from_codes(columns['sensor'], categories=sensor_labels),
+        'Lectura (°C)': columns['value'],
+        'Estado': pd.Categorical.from_codes(columns['status'], categories=STATUS_LABELS),
+        'Tipo de Anomalía': pd.Categorical.from_codes(columns['anomaly_type'], categories=ANOMALY_TYPE_LABELS),
+    }, columns=HISTORY_COLUMNS)
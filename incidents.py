@@ -0,0 +1,169 @@
+import collections
+
+import numpy as np
+
+INCIDENT_OPENED = "opened"
+INCIDENT_ESCALATED = "escalated"
+INCIDENT_RESOLVED = "resolved"
+INCIDENT_EVENT_LABELS = {
+    INCIDENT_OPENED: "Abierto",
+    INCIDENT_ESCALATED: "Escalado",
+    INCIDENT_RESOLVED: "Resuelto",
+}
+
+# Segundos sin lecturas anómalas del sensor tras los cuales su incidente se da por resuelto.
+RESOLVE_AFTER_SECONDS = 60
+# Lecturas anómalas acumuladas a partir de las cuales el incidente sube un nivel.
+ESCALATION_COUNTS = (10, 100, 1000)
+# Con al menos tantos eventos del mismo tipo en un lote se envía un resumen de flota.
+DIGEST_THRESHOLD = 5
+
+_INCIDENT_FIELDS = ('incident_id', 'sensor', 'started_at', 'last_seen', 'count',
+                    'min_value', 'max_value', 'last_value', 'level', 'anomaly_type')
+# Arreglos por sensor del tracker con el estado del incidente abierto.
+_STATE_FIELDS = tuple(name for name in _INCIDENT_FIELDS if name != 'sensor')
+
+
+def _rows(columnas):
+    return [dict(zip(_INCIDENT_FIELDS, fila))
+            for fila in zip(*(np.asarray(columnas[name]).tolist() for name in _INCIDENT_FIELDS))]
+
+
+class IncidentTracker:
+    # A lo sumo un incidente abierto por sensor, guardado en arreglos indexados por el
+    # índice del sensor: ubicar y actualizar el incidente de una lectura es O(1) y un lote
+    # completo se agrega con operaciones vectorizadas. Solo los eventos (apertura,
+    # escalamiento, resolución) se convierten en diccionarios.
+
+    def __init__(self, n_sensors, resolve_after=RESOLVE_AFTER_SECONDS, escalation_counts=ESCALATION_COUNTS,
+                 max_resolved=500):
+        self.n_sensors = int(n_sensors)
+        self.resolve_after = float(resolve_after)
+        self.escalation_counts = np.asarray(sorted(escalation_counts), dtype=np.int64)
+        self.open = np.zeros(self.n_sensors, dtype=bool)
+        self.incident_id = np.zeros(self.n_sensors, dtype=np.int64)
+        self.started_at = np.zeros(self.n_sensors, dtype=np.float64)
+        self.last_seen = np.zeros(self.n_sensors, dtype=np.float64)
+        self.count = np.zeros(self.n_sensors, dtype=np.int64)
+        self.min_value = np.zeros(self.n_sensors, dtype=np.float64)
+        self.max_value = np.zeros(self.n_sensors, dtype=np.float64)
+        self.last_value = np.zeros(self.n_sensors, dtype=np.float64)
+        self.level = np.zeros(self.n_sensors, dtype=np.int8)
+        self.anomaly_type = np.zeros(self.n_sensors, dtype=np.int8)
+        self.opened_counts = np.zeros(self.n_sensors, dtype=np.int64)
+        self.totals = {INCIDENT_OPENED: 0, INCIDENT_ESCALATED: 0, INCIDENT_RESOLVED: 0}
+        self.resolved = collections.deque(maxlen=max_resolved)
+        self._next_id = 1
+
+    @property
+    def open_count(self):
+        return int(np.count_nonzero(self.open))
+
+    def _levels(self, counts):
+        return np.searchsorted(self.escalation_counts, counts, side='right').astype(np.int8)
+
+    def _state(self, sensores):
+        columnas = {name: getattr(self, name)[sensores] for name in _STATE_FIELDS}
+        columnas['sensor'] = sensores
+        return columnas
+
+    def _emit(self, eventos, kind, at, columnas):
+        momentos = np.broadcast_to(np.asarray(at, dtype=np.float64), len(columnas['sensor'])).tolist()
+        for evento, momento in zip(_rows(columnas), momentos):
+            evento.update(event=kind, at=momento)
+            eventos.append(evento)
+            if kind == INCIDENT_RESOLVED:
+                self.resolved.append(evento)
+        self.totals[kind] += len(momentos)
+
+    def _resolve(self, eventos, sensores, at):
+        if sensores.size:
+            self._emit(eventos, INCIDENT_RESOLVED, at, self._state(sensores))
+            self.open[sensores] = False
+
+    def update(self, sensor, timestamps, values, anomaly_codes, anomalous, now):
+        # Agrega las lecturas anómalas del lote a los incidentes de sus sensores y devuelve
+        # los eventos ordenados por hora. Dentro del lote las lecturas de cada sensor se
+        # parten en tramos: un hueco mayor que resolve_after cierra un incidente y abre otro,
+        # así el resultado no depende de cómo se corten los lotes.
+        eventos = []
+        idx = np.flatnonzero(anomalous)
+        if idx.size:
+            idx = idx[np.lexsort((timestamps[idx], sensor[idx]))]
+            s, t, v = sensor[idx], timestamps[idx], values[idx]
+            primera = np.ones(len(idx), dtype=bool)
+            primera[1:] = s[1:] != s[:-1]
+            hueco = np.zeros(len(idx), dtype=bool)
+            hueco[1:] = (t[1:] - t[:-1]) > self.resolve_after
+            inicios = np.flatnonzero(primera | hueco)
+            fines = np.append(inicios[1:], len(idx)) - 1
+            tramo_sensor = s[inicios]
+            abierto = primera[inicios] & self.open[tramo_sensor]
+            continua = abierto & (t[inicios] - self.last_seen[tramo_sensor] <= self.resolve_after)
+            self._resolve(eventos, tramo_sensor[abierto & ~continua], t[inicios][abierto & ~continua])
+
+            previos = np.where(continua, self.count[tramo_sensor], 0)
+            conteo = previos + (fines - inicios + 1)
+            minimo = np.minimum.reduceat(v, inicios)
+            maximo = np.maximum.reduceat(v, inicios)
+            nuevos = ~continua
+            ids = np.where(continua, self.incident_id[tramo_sensor], 0)
+            ids[nuevos] = self._next_id + np.arange(np.count_nonzero(nuevos))
+            self._next_id += int(np.count_nonzero(nuevos))
+            tramos = {
+                'incident_id': ids, 'sensor': tramo_sensor,
+                'started_at': np.where(continua, self.started_at[tramo_sensor], t[inicios]),
+                'last_seen': t[fines], 'count': conteo,
+                'min_value': np.where(continua, np.minimum(minimo, self.min_value[tramo_sensor]), minimo),
+                'max_value': np.where(continua, np.maximum(maximo, self.max_value[tramo_sensor]), maximo),
+                'last_value': v[fines], 'level': self._levels(conteo),
+                'anomaly_type': np.where(continua, self.anomaly_type[tramo_sensor], anomaly_codes[idx][inicios]),
+            }
+            nivel_previo = np.where(continua, self.level[tramo_sensor], 0)
+
+            self._emit(eventos, INCIDENT_OPENED, t[inicios][nuevos], {k: c[nuevos] for k, c in tramos.items()})
+            # Un evento por cada nivel que cruza el tramo, con la hora, el valor y el conteo de
+            # la lectura que alcanzó el umbral: no depende de cuántos niveles caigan en un lote.
+            saltos = np.maximum(tramos['level'].astype(np.int64) - nivel_previo, 0)
+            cruce = np.repeat(np.arange(len(inicios)), saltos)
+            nivel = nivel_previo[cruce] + 1 + np.arange(len(cruce)) - np.repeat(np.cumsum(saltos) - saltos, saltos)
+            umbral = self.escalation_counts[nivel - 1]
+            fila = inicios[cruce] + (umbral - previos[cruce] - 1)
+            escalados = {k: c[cruce] for k, c in tramos.items()}
+            escalados.update(count=umbral, level=nivel.astype(np.int8), last_seen=t[fila], last_value=v[fila])
+            self._emit(eventos, INCIDENT_ESCALATED, t[fila], escalados)
+            # Un tramo seguido de otro del mismo sensor en el lote ya terminó.
+            cerrado = np.zeros(len(inicios), dtype=bool)
+            cerrado[:-1] = tramo_sensor[1:] == tramo_sensor[:-1]
+            siguiente = t[np.append(inicios[1:], 0)]
+            self._emit(eventos, INCIDENT_RESOLVED, siguiente[cerrado], {k: c[cerrado] for k, c in tramos.items()})
+            self.opened_counts += np.bincount(tramo_sensor[nuevos], minlength=self.n_sensors)
+
+            vigente = ~cerrado
+            destino = tramo_sensor[vigente]
+            self.open[destino] = True
+            for name in _STATE_FIELDS:
+                getattr(self, name)[destino] = tramos[name][vigente]
+
+        self._resolve(eventos, np.flatnonzero(self.open & (now - self.last_seen > self.resolve_after)), now)
+        eventos.sort(key=lambda evento: evento['at'])
+        return eventos
+
+    def open_incidents(self, limit=None):
+        # Incidentes abiertos, los de más lecturas primero.
+        sensores = np.flatnonzero(self.open)
+        sensores = sensores[np.argsort(-self.count[sensores], kind='stable')][:limit]
+        return _rows(self._state(sensores))
+
+
+def split_digests(eventos, threshold=DIGEST_THRESHOLD):
+    # Separa los eventos que se notifican uno por uno de los grupos (tipo, eventos) que se
+    # resumen en un solo mensaje porque muchos sensores cambiaron a la vez.
+    if not threshold:
+        return eventos, []
+    por_tipo = collections.defaultdict(list)
+    for evento in eventos:
+        por_tipo[evento['event']].append(evento)
+    resumenes = [(kind, grupo) for kind, grupo in por_tipo.items() if len(grupo) >= threshold]
+    agrupados = {kind for kind, _ in resumenes}
+    return [evento for evento in eventos if evento['event'] not in agrupados], resumenes
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Trama: 1 byte de tipo + 4 bytes little-endian con el largo del contenido, seguido del contenido.
+FRAME_HEADER = struct.Struct("<BI")
+FRAME_BINARY = 1
+FRAME_JSON = 2
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+# Los valores se evalúan en float32 (scorer compilado); uno mayor no se puede representar.
+MAX_READING_VALUE = float(np.finfo(np.float32).max)
+
+# Registro binario empaquetado (16 bytes): índice de sensor, epoch en segundos y valor float32.
+READING_RECORD_DTYPE = np.dtype([('sensor', '<u4'), ('timestamp', '<f8'), ('value', '<f4')])
+
+
+def encode_binary_frame(sensor, timestamps, values):
+    registros = np.empty(len(values), dtype=READING_RECORD_DTYPE)
+    registros['sensor'] = sensor
+    registros['timestamp'] = timestamps
+    registros['value'] = values
+    contenido = registros.tobytes()
+    return FRAME_HEADER.pack(FRAME_BINARY, len(contenido)) + contenido
+
+
+def encode_json_frame(readings):
+    contenido = json.dumps(readings).encode("utf-8")
+    return FRAME_HEADER.pack(FRAME_JSON, len(contenido)) + contenido
+
+
+class ConnectionStats:
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.connected_at = time.monotonic()
+        self.frames = 0
+        self.readings = 0
+        self.rejected = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def as_dict(self):
+        duracion = max(time.monotonic() - self.connected_at, 1e-9)
+        return {
+            'peer': self.peer,
+            'frames': self.frames,
+            'readings': self.readings,
+            'rejected': self.rejected,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'readings_per_s': self.readings / duracion,
+        }
+
+
+class IngestServer:
+    # Servidor TCP asyncio que recibe lotes de lecturas (binario vía np.frombuffer o JSON)
+    # y los entrega al mismo process_readings del motor que usa el simulador. La cola
+    # acotada da contrapresión: si el motor no da abasto, se deja de leer del socket.
+
+    def __init__(self, engine, host="127.0.0.1", port=9009, max_pending_batches=64, max_coalesce=256):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.max_pending_batches = max_pending_batches
+        self.max_coalesce = max_coalesce
+        self._sensor_index = {sensor_id: idx for idx, sensor_id in enumerate(engine.sensor_ids)}
+        self._connections = {}
+        self._closed = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._queue = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.start_error = None
+        self.processed_readings = 0
+        self.processed_batches = 0
+        self.failed_batches = 0
+        self.failed_readings = 0
+        self.last_error = ""
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="ingest-server", daemon=True)
+            self._thread.start()
+            self._ready.wait(5.0)
+            if self.start_error is not None:
+                raise self.start_error
+        return self
+
+    def stop(self, timeout=5.0):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self.serve())
+        except OSError as e:
+            self.start_error = e
+            self._loop.close()
+            return
+        finally:
+            self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            pendientes = asyncio.all_tasks(self._loop)
+            for tarea in pendientes:
+                tarea.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pendientes, return_exceptions=True))
+            self._loop.close()
+
+    async def serve(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending_batches)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        asyncio.get_running_loop().create_task(self._consume())
+        return self._server
+
+    def metrics(self):
+        with self._lock:
+            conexiones = [stats.as_dict() for stats in self._connections.values()]
+            cerradas = list(self._closed)
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'processed_readings': self.processed_readings,
+            'processed_batches': self.processed_batches,
+            'failed_batches': self.failed_batches,
+            'failed_readings': self.failed_readings,
+            'last_error': self.last_error,
+            'connections': conexiones,
+            'closed_connections': len(cerradas),
+            'closed_readings': sum(stats['readings'] for stats in cerradas),
+        }
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        stats = ConnectionStats(f"{peer[0]}:{peer[1]}" if peer else "?")
+        with self._lock:
+            self._connections[id(writer)] = stats
+        try:
+            while True:
+                try:
+                    cabecera = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                tipo, largo = FRAME_HEADER.unpack(cabecera)
+                if largo > MAX_FRAME_BYTES:
+                    stats.errors += 1
+                    break
+                contenido = await reader.readexactly(largo)
+                stats.frames += 1
+                stats.bytes += FRAME_HEADER.size + largo
+                try:
+                    lote = self._parse(tipo, contenido)
+                except (ValueError, KeyError, TypeError):
+                    stats.errors += 1
+                    continue
+                lote, rechazadas = self._validate(*lote)
+                stats.rejected += rechazadas
+                if len(lote[0]):
+                    stats.readings += len(lote[0])
+                    await self._queue.put(lote)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            stats.errors += 1
+        finally:
+            with self._lock:
+                self._connections.pop(id(writer), None)
+                self._closed.append(stats.as_dict())
+                del self._closed[:-100]
+            writer.close()
+
+    def _parse(self, tipo, contenido):
+        if tipo == FRAME_BINARY:
+            if len(contenido) % READING_RECORD_DTYPE.itemsize:
+                raise ValueError("Largo de trama binaria no es múltiplo del tamaño de registro")
+            registros = np.frombuffer(contenido, dtype=READING_RECORD_DTYPE)
+            return registros['sensor'], registros['timestamp'], registros['value']
+        if tipo == FRAME_JSON:
+            lecturas = json.loads(contenido)
+            sensor = np.fromiter(
+                (self._sensor_index.get(lectura['sensor_id'], -1) if 'sensor_id' in lectura else lectura['sensor']
+                 for lectura in lecturas), dtype=np.int64, count=len(lecturas))
+            timestamps = np.fromiter((lectura.get('timestamp', time.time()) for lectura in lecturas),
+                                     dtype=np.float64, count=len(lecturas))
+            valores = np.fromiter((lectura['value'] for lectura in lecturas), dtype=np.float64, count=len(lecturas))
+            return sensor, timestamps, valores
+        raise ValueError(f"Tipo de trama desconocido: {tipo}")
+
+    def _validate(self, sensor, timestamps, values):
+        valida = ((sensor >= 0) & (sensor < len(self._sensor_index)) & np.isfinite(values) & np.isfinite(timestamps)
+                  & (np.abs(values) <= MAX_READING_VALUE))
+        if valida.all():
+            return (sensor, timestamps, values), 0
+        return (sensor[valida], timestamps[valida], values[valida]), int(np.count_nonzero(~valida))
+
+    async def _consume(self):
+        # Junta los lotes que ya esperan en la cola en una sola llamada al motor y la corre
+        # fuera del event loop para no frenar la lectura de los sockets. Un lote que el motor
+        # rechaza se cuenta como fallido; la tarea sigue drenando la cola.
+        while True:
+            lotes = [await self._queue.get()]
+            while len(lotes) < self.max_coalesce and not self._queue.empty():
+                lotes.append(self._queue.get_nowait())
+            sensor = np.concatenate([lote[0] for lote in lotes])
+            timestamps = np.concatenate([lote[1] for lote in lotes])
+            values = np.concatenate([lote[2] for lote in lotes])
+            try:
+                await asyncio.to_thread(self.engine.process_readings, sensor, timestamps, values)
+            except Exception as e:
+                self.failed_batches += len(lotes)
+                self.failed_readings += len(values)
+                self.last_error = str(e)
+                continue
+            self.processed_readings += len(values)
+            self.processed_batches += len(lotes)
@@ -0,0 +1,173 @@
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Límites superiores (segundos) de los buckets de latencia: 50 µs a ~13 s, duplicando.
+LATENCY_BUCKETS = tuple(50e-6 * 2 ** i for i in range(19))
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def null_timer(stage):
+    # Reemplazo de MetricsRegistry.timer cuando la instrumentación está apagada.
+    return _NULL_TIMER
+
+
+class LatencyHistogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = np.asarray(buckets, dtype=np.float64)
+        self.counts = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.last = 0.0
+
+    def observe(self, seconds):
+        self.counts[np.searchsorted(self.buckets, seconds, side='left')] += 1
+        self.count += 1
+        self.sum += seconds
+        self.last = seconds
+
+    def quantile(self, q):
+        # Estimación por el límite superior del bucket que contiene el cuantil.
+        if self.count == 0:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(self.counts), q * self.count, side='left'))
+        return float(self.buckets[idx]) if idx < len(self.buckets) else float('inf')
+
+
+class _StageTimer:
+    __slots__ = ('registry', 'stage', 'start')
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    # Histogramas de latencia por etapa, contadores y gauges. Los gauges son funciones que
+    # se evalúan solo al leer las métricas, así no cuestan nada en el ciclo de ingesta.
+
+    def __init__(self, namespace="sensores"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def timer(self, stage):
+        return _StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histograma = self._histograms.get(stage)
+            if histograma is None:
+                histograma = self._histograms[stage] = LatencyHistogram()
+            histograma.observe(seconds)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def register_gauge(self, name, function):
+        self._gauges[name] = function
+
+    def stage_summary(self):
+        with self._lock:
+            return {
+                stage: {
+                    'count': h.count,
+                    'mean_s': h.sum / h.count if h.count else 0.0,
+                    'p50_s': h.quantile(0.5),
+                    'p99_s': h.quantile(0.99),
+                    'last_s': h.last,
+                }
+                for stage, h in self._histograms.items()
+            }
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def gauges(self):
+        resultado = {}
+        for name, function in list(self._gauges.items()):
+            try:
+                resultado[name] = float(function())
+            except Exception:
+                resultado[name] = float('nan')
+        return resultado
+
+    def render_prometheus(self):
+        ns = self.namespace
+        lineas = [f"# HELP {ns}_stage_seconds Latencia por etapa del ciclo de lecturas.",
+                  f"# TYPE {ns}_stage_seconds histogram"]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                acumulado = np.cumsum(h.counts)
+                for limite, total in zip(h.buckets, acumulado):
+                    lineas.append(f'{ns}_stage_seconds_bucket{{stage="{stage}",le="{limite:.6g}"}} {total}')
+                lineas.append(f'{ns}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lineas.append(f'{ns}_stage_seconds_sum{{stage="{stage}"}} {h.sum:.9g}')
+                lineas.append(f'{ns}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            contadores = sorted(self._counters.items())
+        for name, valor in contadores:
+            lineas.append(f"# TYPE {ns}_{name} counter")
+            lineas.append(f"{ns}_{name} {valor}")
+        for name, valor in sorted(self.gauges().items()):
+            lineas.append(f"# TYPE {ns}_{name} gauge")
+            lineas.append(f"{ns}_{name} {valor:.9g}")
+        return "\n".join(lineas) + "\n"
+
+
+class MetricsServer:
+    # Expone MetricsRegistry en formato de texto de Prometheus (GET /metrics) desde un hilo propio.
+
+    def __init__(self, registry, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server is None:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    cuerpo = registry.render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+
+                def log_message(self, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.port = self._server.server_address[1]
+            self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
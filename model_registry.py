@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import joblib
+import numpy as np
+
+from models import CompiledScalarForest, compile_forest, contamination_offset
+
+MANIFEST_NAME = "manifest.json"
+MODEL_FILE = "model.joblib"
+BREAKPOINTS_FILE = "breakpoints.npy"
+INTERVAL_SCORES_FILE = "interval_scores.npy"
+TRAINING_SCORES_FILE = "training_scores.npy"
+
+
+def data_hash(data):
+    datos = np.ascontiguousarray(np.asarray(data, dtype=np.float64))
+    return hashlib.sha256(datos.tobytes() + str(datos.shape).encode()).hexdigest()[:16]
+
+
+def _write_json(path, contenido):
+    temporal = f"{path}.tmp"
+    with open(temporal, "w") as f:
+        json.dump(contenido, f, indent=2)
+    os.replace(temporal, path)
+
+
+class StoredForest:
+    # Modelo leído del registro. Para evaluar solo hacen falta los cortes y scores
+    # compilados (memory-mapped, el SO los pagina bajo demanda) y el umbral; el
+    # IsolationForest completo se carga recién si alguien lo pide (estimator).
+
+    def __init__(self, directory, metadata):
+        self.directory = directory
+        self.metadata = metadata
+        self.version = metadata['version']
+        self.n_features_in_ = metadata['n_features']
+        self.contamination = metadata['contamination']
+        self.offset_ = metadata['offset']
+        self._estimator = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Lo que identifica al modelo es su directorio versionado: así joblib.hash y el
+        # envío a otros procesos no serializan los arreglos ni el bosque.
+        return {'directory': self.directory, 'metadata': self.metadata,
+                'contamination': self.contamination, 'offset_': self.offset_}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['metadata'])
+        self.contamination = state['contamination']
+        self.offset_ = state['offset_']
+
+    def _array(self, name):
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+    @property
+    def training_scores_(self):
+        return self._array(TRAINING_SCORES_FILE)
+
+    @property
+    def estimator(self):
+        with self._lock:
+            if self._estimator is None:
+                estimator = joblib.load(os.path.join(self.directory, MODEL_FILE), mmap_mode='r')
+                estimator.contamination = self.contamination
+                estimator.offset_ = self.offset_
+                self._estimator = estimator
+            return self._estimator
+
+    def set_contamination(self, contamination):
+        self.offset_ = contamination_offset(self.training_scores_, contamination)
+        self.contamination = contamination if contamination == "auto" else float(contamination)
+        if self._estimator is not None:
+            self._estimator.contamination = self.contamination
+            self._estimator.offset_ = self.offset_
+        return self
+
+    def compiled(self):
+        if self.n_features_in_ != 1:
+            raise ValueError("Solo los modelos de una variable tienen forma compilada")
+        return CompiledScalarForest.from_arrays(self, self._array(BREAKPOINTS_FILE), self._array(INTERVAL_SCORES_FILE))
+
+    def score_samples(self, X):
+        return self.estimator.score_samples(X)
+
+    def decision_function(self, X):
+        return self.estimator.decision_function(X)
+
+    def predict(self, X):
+        return self.estimator.predict(X)
+
+
+class ModelRegistry:
+    # Modelos por sensor versionados en disco:
+    #   root/<sensor_id>/manifest.json  versiones, metadatos y versión fijada (pinned)
+    #   root/<sensor_id>/v0001/         model.joblib + cortes/scores compilados en .npy
+    # La versión activa es la fijada o, si no hay, la más reciente.
+
+    def __init__(self, root, keep_versions=5):
+        self.root = root
+        self.keep_versions = keep_versions
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _sensor_dir(self, sensor_id):
+        return os.path.join(self.root, sensor_id)
+
+    def _manifest(self, sensor_id):
+        try:
+            with open(os.path.join(self._sensor_dir(sensor_id), MANIFEST_NAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'sensor_id': sensor_id, 'pinned': None, 'versions': []}
+
+    def _save_manifest(self, sensor_id, manifest):
+        _write_json(os.path.join(self._sensor_dir(sensor_id), MANIFEST_NAME), manifest)
+
+    def sensors(self):
+        return sorted(nombre for nombre in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, nombre, MANIFEST_NAME)))
+
+    def versions(self, sensor_id):
+        return self._manifest(sensor_id)['versions']
+
+    def active_version(self, sensor_id):
+        manifest = self._manifest(sensor_id)
+        if manifest['pinned'] is not None:
+            return manifest['pinned']
+        return manifest['versions'][-1]['version'] if manifest['versions'] else None
+
+    def is_pinned(self, sensor_id):
+        return self._manifest(sensor_id)['pinned'] is not None
+
+    def save(self, sensor_id, model, training_data, window=None, feature_window=None):
+        # Escribe la versión en un directorio temporal y la publica con un rename, así un
+        # lector nunca ve una versión a medias.
+        compiled = compile_forest(model) if model.n_features_in_ == 1 else None
+        with self._lock:
+            manifest = self._manifest(sensor_id)
+            version = (manifest['versions'][-1]['version'] + 1) if manifest['versions'] else 1
+            destino = os.path.join(self._sensor_dir(sensor_id), f"v{version:04d}")
+            temporal = destino + ".tmp"
+            shutil.rmtree(temporal, ignore_errors=True)
+            os.makedirs(temporal)
+            joblib.dump(model, os.path.join(temporal, MODEL_FILE))
+            np.save(os.path.join(temporal, TRAINING_SCORES_FILE), np.asarray(model.training_scores_))
+            if compiled is not None:
+                np.save(os.path.join(temporal, BREAKPOINTS_FILE), compiled.breakpoints)
+                np.save(os.path.join(temporal, INTERVAL_SCORES_FILE), compiled.interval_scores)
+            os.replace(temporal, destino)
+            metadata = {
+                'version': version,
+                'created_at': time.time(),
+                'window': window if window is not None else int(np.shape(training_data)[0]),
+                'feature_window': feature_window,
+                'n_features': int(model.n_features_in_),
+                'contamination': model.contamination,
+                'offset': float(model.offset_),
+                'data_hash': data_hash(training_data),
+                'n_estimators': len(model.estimators_),
+            }
+            manifest['versions'].append(metadata)
+            descartadas = self._prune(manifest)
+            self._save_manifest(sensor_id, manifest)
+            for vieja in descartadas:
+                shutil.rmtree(os.path.join(self._sensor_dir(sensor_id), f"v{vieja:04d}"), ignore_errors=True)
+        return version
+
+    def _prune(self, manifest):
+        # Conserva las keep_versions más recientes y la fijada; devuelve las descartadas.
+        if not self.keep_versions or len(manifest['versions']) <= self.keep_versions:
+            return []
+        recientes = {metadata['version'] for metadata in manifest['versions'][-self.keep_versions:]}
+        conservar = recientes | {manifest['pinned']}
+        descartadas = [metadata['version'] for metadata in manifest['versions'] if metadata['version'] not in conservar]
+        manifest['versions'] = [metadata for metadata in manifest['versions'] if metadata['version'] in conservar]
+        return descartadas
+
+    def load(self, sensor_id, version=None):
+        manifest = self._manifest(sensor_id)
+        version = self.active_version(sensor_id) if version is None else int(version)
+        for metadata in manifest['versions']:
+            if metadata['version'] == version:
+                return StoredForest(os.path.join(self._sensor_dir(sensor_id), f"v{version:04d}"), metadata)
+        raise KeyError(f"{sensor_id} no tiene la versión {version}")
+
+    def load_fleet(self, sensor_ids):
+        # Modelos activos de los sensores que tienen alguno; solo se leen los manifiestos.
+        modelos = {}
+        for sensor_id in sensor_ids:
+            if self.active_version(sensor_id) is not None:
+                modelos[sensor_id] = self.load(sensor_id)
+        return modelos
+
+    def pin(self, sensor_id, version):
+        with self._lock:
+            manifest = self._manifest(sensor_id)
+            if not any(metadata['version'] == int(version) for metadata in manifest['versions']):
+                raise KeyError(f"{sensor_id} no tiene la versión {version}")
+            manifest['pinned'] = int(version)
+            self._save_manifest(sensor_id, manifest)
+
+    def unpin(self, sensor_id):
+        with self._lock:
+            manifest = self._manifest(sensor_id)
+            manifest['pinned'] = None
+            self._save_manifest(sensor_id, manifest)
+
+    def rollback(self, sensor_id):
+        # Fija la versión anterior a la activa y la devuelve.
+        versiones = [metadata['version'] for metadata in self.versions(sensor_id)]
+        activa = self.active_version(sensor_id)
+        anteriores = [version for version in versiones if version < activa] if activa is not None else []
+        if not anteriores:
+            raise ValueError(f"{sensor_id} no tiene una versión anterior a la {activa}")
+        self.pin(sensor_id, anteriores[-1])
+        return anteriores[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registro de modelos por sensor.")
+    parser.add_argument("--root", default="data/modelos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list").add_argument("sensor_id", nargs="?")
+    pin = sub.add_parser("pin")
+    pin.add_argument("sensor_id")
+    pin.add_argument("version", type=int)
+    sub.add_parser("unpin").add_argument("sensor_id")
+    sub.add_parser("rollback").add_argument("sensor_id")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.root)
+    if args.command == "list":
+        for sensor_id in [args.sensor_id] if args.sensor_id else registry.sensors():
+            activa = registry.active_version(sensor_id)
+            fijada = " (fijada)" if registry.is_pinned(sensor_id) else ""
+            print(f"{sensor_id}: activa v{activa}{fijada}")
+            for metadata in registry.versions(sensor_id):
+                print(f"  v{metadata['version']} ventana={metadata['window']} contaminación={metadata['contamination']} "
+                      f"hash={metadata['data_hash']} creada={time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metadata['created_at']))}")
+    elif args.command == "pin":
+        registry.pin(args.sensor_id, args.version)
+    elif args.command == "unpin":
+        registry.unpin(args.sensor_id)
+    elif args.command == "rollback":
+        print(f"{args.sensor_id}: fijada v{registry.rollback(args.sensor_id)}")
+
+
+if __name__ == "__main__":
+    main()
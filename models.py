@@ -0,0 +1,170 @@
+import numpy as np
+
+
+def contamination_offset(training_scores, contamination):
+    # Umbral de IsolationForest para una contaminación dada a partir de los score_samples
+    # de entrenamiento (lo mismo que calcula fit con esa contaminación).
+    if contamination == "auto":
+        return -0.5
+    contamination = float(contamination)
+    if not 0.0 < contamination <= 0.5:
+        raise ValueError(f"contamination debe estar en (0, 0.5], se recibió {contamination}")
+    return np.percentile(training_scores, 100.0 * contamination)
+
+
+def _build_retunable_forest():
+    # sklearn tarda ~1 s en importarse; la clase se arma la primera vez que se pide
+    # (ver __getattr__), así importar este módulo o scoring no lo carga.
+    from sklearn.ensemble import IsolationForest
+
+    class RetunableIsolationForest(IsolationForest):
+        # La contaminación solo mueve el umbral (offset_), no los árboles: se ajusta el
+        # bosque una vez, se guardan los score_samples de entrenamiento y el umbral
+        # para cualquier contaminación se obtiene de esa distribución sin re-entrenar.
+
+        def fit(self, X, y=None, sample_weight=None):
+            contamination = self.contamination
+            self.contamination = "auto"
+            try:
+                super().fit(X, y=y, sample_weight=sample_weight)
+            finally:
+                self.contamination = contamination
+            self.training_scores_ = np.sort(self.score_samples(X))
+            self.set_contamination(contamination)
+            return self
+
+        def set_contamination(self, contamination):
+            self.offset_ = contamination_offset(self.training_scores_, contamination)
+            self.contamination = contamination if contamination == "auto" else float(contamination)
+            return self
+
+    RetunableIsolationForest.__module__ = __name__
+    RetunableIsolationForest.__qualname__ = "RetunableIsolationForest"
+    return RetunableIsolationForest
+
+
+def __getattr__(name):
+    if name == "RetunableIsolationForest":
+        clase = globals()[name] = _build_retunable_forest()
+        return clase
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class CompiledScalarForest:
+    # Un IsolationForest entrenado con una sola variable es constante por tramos:
+    # se extraen todos los umbrales de corte de los árboles, se evalúa el score una
+    # vez por intervalo y las predicciones se resuelven con np.searchsorted.
+    # El umbral (offset_) se lee del modelo en cada llamada, así set_contamination
+    # sigue funcionando sin recompilar.
+
+    def __init__(self, model):
+        if model.n_features_in_ != 1:
+            raise ValueError("CompiledScalarForest solo admite modelos entrenados con una variable")
+        self.model = model
+        thresholds = [
+            estimator.tree_.threshold[estimator.tree_.feature >= 0]
+            for estimator in model.estimators_
+        ]
+        self.breakpoints = np.unique(np.concatenate(thresholds)) if thresholds else np.empty(0)
+        self.interval_scores = model.score_samples(self._representatives().reshape(-1, 1))
+
+    @classmethod
+    def from_arrays(cls, model, breakpoints, interval_scores):
+        # Reconstruye el modelo compilado desde arreglos ya calculados (p. ej. leídos por mmap
+        # del registro) sin recorrer los árboles; model solo aporta offset_.
+        compiled = cls.__new__(cls)
+        compiled.model = model
+        compiled.breakpoints = breakpoints
+        compiled.interval_scores = interval_scores
+        return compiled
+
+    def _representatives(self):
+        # Los árboles comparan la entrada en float32 contra umbrales float64 (x <= t va
+        # a la izquierda), así que cada intervalo (t[i-1], t[i]] se representa con el
+        # mayor float32 <= t[i] y el último intervalo con el menor float32 > t[-1].
+        if self.breakpoints.size == 0:
+            return np.zeros(1, dtype=np.float32)
+        representatives = self.breakpoints.astype(np.float32)
+        above = representatives.astype(np.float64) > self.breakpoints
+        representatives[above] = np.nextafter(representatives[above], np.float32(-np.inf))
+        last = np.float32(self.breakpoints[-1])
+        if last <= self.breakpoints[-1]:
+            last = np.nextafter(last, np.float32(np.inf))
+        return np.append(representatives, last)
+
+    @property
+    def offset_(self):
+        return self.model.offset_
+
+    def _interval_index(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != 1:
+            raise ValueError(f"Se esperaba un arreglo de forma (n, 1), se recibió {X.shape}")
+        if not np.isfinite(X).all():
+            raise ValueError("La entrada contiene NaN, infinito o un valor demasiado grande para float32")
+        return np.searchsorted(self.breakpoints, X[:, 0].astype(np.float64), side="left")
+
+    def score_samples(self, X):
+        return self.interval_scores[self._interval_index(X)]
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.model.offset_
+
+    def predict(self, X):
+        is_inlier = np.ones(np.shape(X)[0], dtype=int)
+        is_inlier[self.decision_function(X) < 0] = -1
+        return is_inlier
+
+
+class CompiledForestBank:
+    # Varios CompiledScalarForest (uno por sensor) evaluados en una sola pasada: los
+    # cortes de todos los modelos van concatenados y cada lectura hace una búsqueda
+    # binaria vectorizada dentro del tramo de su modelo, sin un llamado por modelo.
+    # Da exactamente el mismo resultado que searchsorted(side="left") de cada modelo.
+
+    def __init__(self, forests):
+        self.forests = list(forests)
+        largos = np.array([forest.breakpoints.size for forest in self.forests], dtype=np.intp)
+        self.breakpoints = np.concatenate([forest.breakpoints for forest in self.forests])
+        self.interval_scores = np.concatenate([forest.interval_scores for forest in self.forests])
+        self.start = np.concatenate([[0], np.cumsum(largos)[:-1]]).astype(np.intp)
+        self.length = largos
+        self.score_start = self.start + np.arange(len(self.forests))
+        self._steps = int(np.ceil(np.log2(largos.max() + 1))) if largos.size else 0
+        self.refresh_offsets()
+
+    def refresh_offsets(self):
+        self.offsets = np.array([forest.offset_ for forest in self.forests], dtype=np.float64)
+
+    def _interval_index(self, model_index, values):
+        values = np.asarray(values, dtype=np.float32)
+        if not np.isfinite(values).all():
+            raise ValueError("La entrada contiene NaN, infinito o un valor demasiado grande para float32")
+        values = values.astype(np.float64)
+        lo = self.start[model_index]
+        hi = lo + self.length[model_index]
+        ultimo = max(self.breakpoints.size - 1, 0)
+        for _ in range(self._steps):
+            abierto = lo < hi
+            mid = (lo + hi) >> 1
+            menor = (self.breakpoints[np.minimum(mid, ultimo)] < values) & abierto
+            lo = np.where(menor, mid + 1, lo)
+            hi = np.where(abierto & ~menor, mid, hi)
+        return self.score_start[model_index] + (lo - self.start[model_index])
+
+    def score_samples(self, model_index, values):
+        return self.interval_scores[self._interval_index(model_index, values)]
+
+    def decision_function(self, model_index, values):
+        return self.score_samples(model_index, values) - self.offsets[model_index]
+
+    def predict(self, model_index, values):
+        return np.where(self.decision_function(model_index, values) < 0, -1, 1)
+
+
+def compile_forest(model):
+    # Los modelos que ya traen sus cortes compilados (p. ej. los del registro en disco)
+    # los entregan con compiled(); al resto se les recorren los árboles.
+    if hasattr(model, "compiled"):
+        return model.compiled()
+    return CompiledScalarForest(model)
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+# (segundos por bucket, buckets que se conservan por sensor): 1 h a 10 s, 24 h a 1 min y
+# 14 días a 1 h.
+ROLLUP_TIERS = ((10, 360), (60, 1440), (3600, 14 * 24))
+
+ROLLUP_COLUMNS = ['Hora', 'Sensor ID', 'Promedio (°C)', 'Mínimo (°C)', 'Máximo (°C)', 'Lecturas', 'Anomalías']
+
+
+class RollupTier:
+    # Un anillo de `capacity` buckets por sensor: el bucket b (hora // resolution) vive en la
+    # columna b % capacity, así que agregar una lectura es O(1) y leer una ventana cuesta lo
+    # mismo sin importar cuántas lecturas crudas haya detrás.
+
+    def __init__(self, n_sensors, resolution, capacity):
+        if resolution <= 0 or capacity <= 0:
+            raise ValueError("resolution y capacity deben ser mayores que cero")
+        self.n_sensors = int(n_sensors)
+        self.resolution = float(resolution)
+        self.capacity = int(capacity)
+        forma = (self.n_sensors, self.capacity)
+        self.bucket = np.full(forma, -1, dtype=np.int64)
+        self.count = np.zeros(forma, dtype=np.int32)
+        self.anomalies = np.zeros(forma, dtype=np.int32)
+        self.sum = np.zeros(forma, dtype=np.float64)
+        self.min = np.zeros(forma, dtype=np.float32)
+        self.max = np.zeros(forma, dtype=np.float32)
+        self._newest = np.full(self.n_sensors, np.iinfo(np.int64).min, dtype=np.int64)
+
+    @property
+    def retention(self):
+        return self.resolution * self.capacity
+
+    @property
+    def nbytes(self):
+        return sum(arreglo.nbytes for arreglo in (self.bucket, self.count, self.anomalies, self.sum, self.min, self.max))
+
+    def update(self, sensor, timestamps, values, anomalous):
+        # Las lecturas del lote se agrupan por (sensor, bucket) y cada grupo se combina con su
+        # columna: se suma si es el mismo bucket, la reemplaza si es más nuevo y se descarta si
+        # ya salió de la retención.
+        bucket = np.floor_divide(timestamps, self.resolution).astype(np.int64)
+        orden = np.lexsort((bucket, sensor))
+        s, b, v = sensor[orden], bucket[orden], values[orden]
+        inicios = np.flatnonzero(np.r_[True, (s[1:] != s[:-1]) | (b[1:] != b[:-1])])
+        grupo_sensor, grupo_bucket = s[inicios], b[inicios]
+        np.maximum.at(self._newest, grupo_sensor, grupo_bucket)
+        vigente = grupo_bucket > self._newest[grupo_sensor] - self.capacity
+        columna = grupo_bucket % self.capacity
+        guardado = self.bucket[grupo_sensor, columna]
+        igual = vigente & (guardado == grupo_bucket)
+        nuevo = vigente & (guardado < grupo_bucket)
+
+        conteo = np.diff(np.append(inicios, len(s))).astype(np.int32)
+        suma = np.add.reduceat(v, inicios)
+        minimo = np.minimum.reduceat(v, inicios).astype(np.float32)
+        maximo = np.maximum.reduceat(v, inicios).astype(np.float32)
+        anomalas = np.add.reduceat(anomalous[orden].astype(np.int32), inicios)
+
+        fila, col = grupo_sensor[nuevo], columna[nuevo]
+        self.bucket[fila, col] = grupo_bucket[nuevo]
+        self.count[fila, col] = conteo[nuevo]
+        self.anomalies[fila, col] = anomalas[nuevo]
+        self.sum[fila, col] = suma[nuevo]
+        self.min[fila, col] = minimo[nuevo]
+        self.max[fila, col] = maximo[nuevo]
+
+        fila, col = grupo_sensor[igual], columna[igual]
+        self.count[fila, col] += conteo[igual]
+        self.anomalies[fila, col] += anomalas[igual]
+        self.sum[fila, col] += suma[igual]
+        self.min[fila, col] = np.minimum(self.min[fila, col], minimo[igual])
+        self.max[fila, col] = np.maximum(self.max[fila, col], maximo[igual])
+
+    def window(self, start, end=None):
+        # Buckets de todos los sensores entre start y end, ordenados por hora.
+        primero = np.floor_divide(start, self.resolution)
+        ultimo = np.iinfo(np.int64).max if end is None else np.floor_divide(end, self.resolution)
+        filas, cols = np.nonzero((self.bucket >= primero) & (self.bucket <= ultimo))
+        orden = np.argsort(self.bucket[filas, cols], kind='stable')
+        filas, cols = filas[orden], cols[orden]
+        conteo = self.count[filas, cols]
+        return {
+            'timestamp': self.bucket[filas, cols] * self.resolution,
+            'sensor': filas,
+            'count': conteo,
+            'mean': self.sum[filas, cols] / conteo,
+            'min': self.min[filas, cols],
+            'max': self.max[filas, cols],
+            'anomalies': self.anomalies[filas, cols],
+        }
+
+
+class RollupStore:
+    # Los tiers de agregados (de más fino a más grueso), actualizados con cada lote del motor.
+
+    def __init__(self, n_sensors, tiers=ROLLUP_TIERS):
+        self.tiers = [RollupTier(n_sensors, resolution, capacity)
+                      for resolution, capacity in sorted(tiers)]
+        self.first_timestamp = None
+
+    @property
+    def nbytes(self):
+        return sum(tier.nbytes for tier in self.tiers)
+
+    def update(self, sensor, timestamps, values, anomalous):
+        if len(values) == 0:
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamps.min())
+        for tier in self.tiers:
+            tier.update(sensor, timestamps, values, anomalous)
+
+    def pick(self, seconds, max_points):
+        # Entre los tiers que cubren `seconds`, el que da un número de buckets por sensor más
+        # cercano (en proporción) a max_points; si ninguno cubre, el de mayor retención.
+        cubren = [tier for tier in self.tiers if tier.retention >= seconds]
+        if not cubren:
+            return max(self.tiers, key=lambda tier: tier.retention)
+        return min(cubren, key=lambda tier: abs(np.log(seconds / tier.resolution / max_points)))
+
+
+def rollups_to_dataframe(columns, sensor_labels, tz=None):
+    horas = pd.to_datetime(columns['timestamp'], unit='s', utc=True)
+    if tz is not None:
+        horas = horas.tz_convert(tz)
+    return pd.DataFrame({
+        'Hora': horas.tz_localize(None),
+        'Sensor ID': pd.Categorical.from_codes(columns['sensor'], categories=sensor_labels),
+        'Promedio (°C)': columns['mean'],
+        'Mínimo (°C)': columns['min'],
+        'Máximo (°C)': columns['max'],
+        'Lecturas': columns['count'],
+        'Anomalías': columns['anomalies'],
+    }, columns=ROLLUP_COLUMNS)
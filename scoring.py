@@ -0,0 +1,89 @@
+import joblib
+import numpy as np
+
+from models import CompiledForestBank, CompiledScalarForest, compile_forest
+
+
+def group_sensors_by_model(sensor_models, sensor_ids, by_content=True):
+    # Agrupa sensores con modelos idénticos (misma instancia o mismo contenido serializado)
+    # para evaluarlos con una sola llamada al modelo. Con by_content=False solo se agrupa
+    # por instancia: hashear miles de modelos distintos cuesta más de lo que ahorra.
+    fingerprints = {}
+    groups = {}
+    for idx, sensor_id in enumerate(sensor_ids):
+        model = sensor_models[sensor_id]
+        if id(model) not in fingerprints:
+            fingerprints[id(model)] = joblib.hash(model) if by_content else id(model)
+        key = fingerprints[id(model)]
+        if key not in groups:
+            groups[key] = (model, [])
+        groups[key][1].append(idx)
+    return [(model, np.asarray(indices, dtype=np.intp)) for model, indices in groups.values()]
+
+
+class BatchScorer:
+
+    def __init__(self, sensor_models, sensor_ids, compiled=False, dedupe=True):
+        self.sensor_ids = list(sensor_ids)
+        self.groups = group_sensors_by_model(sensor_models, self.sensor_ids, by_content=dedupe)
+        if compiled:
+            self.groups = [
+                (compile_forest(model) if model.n_features_in_ == 1 else model, columns)
+                for model, columns in self.groups
+            ]
+        self._group_of_sensor = np.empty(len(self.sensor_ids), dtype=np.intp)
+        for grupo, (_, columns) in enumerate(self.groups):
+            self._group_of_sensor[columns] = grupo
+        # Con un modelo compilado por sensor (o por grupo) todos se evalúan juntos en el banco.
+        self._bank = None
+        if len(self.groups) > 1 and all(isinstance(model, CompiledScalarForest) for model, _ in self.groups):
+            self._bank = CompiledForestBank([model for model, _ in self.groups])
+
+    def refresh_thresholds(self):
+        # Llamar después de set_contamination: el banco guarda los umbrales en un arreglo.
+        if self._bank is not None:
+            self._bank.refresh_offsets()
+
+    def _apply(self, method, values, dtype):
+        values = np.asarray(values, dtype=np.float64)
+        n_sensors = len(self.sensor_ids)
+        if values.shape[-1] != n_sensors:
+            raise ValueError(f"Se esperaban {n_sensors} lecturas por tick, se recibieron {values.shape[-1]}")
+        ticks = values.reshape(-1, n_sensors)
+        if self._bank is not None:
+            grupos = np.broadcast_to(self._group_of_sensor, ticks.shape).ravel()
+            return getattr(self._bank, method)(grupos, ticks.ravel()).astype(dtype, copy=False).reshape(values.shape)
+        result = np.empty(ticks.shape, dtype=dtype)
+        for model, columns in self.groups:
+            batch = ticks[:, columns].reshape(-1, 1)
+            result[:, columns] = getattr(model, method)(batch).reshape(len(ticks), len(columns))
+        return result.reshape(values.shape)
+
+    def _apply_readings(self, method, sensor, values, dtype):
+        # Lecturas sueltas (índice de sensor, valor) en cualquier orden, como llegan por red.
+        # values puede ser (n,) para modelos escalares o (n, n_features) para modelos por ventana.
+        values = np.asarray(values, dtype=np.float64)
+        values = values.reshape(len(values), -1)
+        if len(self.groups) == 1:
+            return getattr(self.groups[0][0], method)(values).astype(dtype, copy=False)
+        grupo = self._group_of_sensor[np.asarray(sensor, dtype=np.intp)]
+        if self._bank is not None:
+            return getattr(self._bank, method)(grupo, values[:, 0]).astype(dtype, copy=False)
+        result = np.empty(len(values), dtype=dtype)
+        for g, (model, _) in enumerate(self.groups):
+            filas = np.flatnonzero(grupo == g)
+            if filas.size:
+                result[filas] = getattr(model, method)(values[filas])
+        return result
+
+    def predict_readings(self, sensor, values):
+        return self._apply_readings("predict", sensor, values, np.int8)
+
+    def predict(self, values):
+        return self._apply("predict", values, np.int8)
+
+    def score_samples(self, values):
+        return self._apply("score_samples", values, np.float64)
+
+    def decision_function(self, values):
+        return self._apply("decision_function", values, np.float64)
@@ -0,0 +1,116 @@
+import numpy as np
+
+FAILURE_NONE = 0
+FAILURE_PICO_ALTO = 1
+FAILURE_CAIDA_BAJA = 2
+FAILURE_VALOR_CONSTANTE = 3
+FAILURE_TYPE_LABELS = ("N/A", "Pico Alto", "Caída Baja", "Valor Constante")
+# Los códigos de anomalía del historial: 0 = N/A, 1..3 = fallo nuevo, 4..6 = fallo persistente.
+PERSISTENT_CODE_OFFSET = len(FAILURE_TYPE_LABELS) - 1
+
+# Rango uniforme (bajo, alto) de la lectura para cada tipo de fallo.
+FAILURE_VALUE_RANGES = np.array([
+    [0.0, 0.0],
+    [45.0, 55.0],
+    [5.0, 10.0],
+    [22.0, 24.0],
+])
+
+# Calendario original del tablero: el sensor idx falla en el tick i si (i + idx) % periodo == 0,
+# evaluado en este orden de prioridad.
+DEFAULT_FAILURE_SCHEDULE = (
+    (FAILURE_PICO_ALTO, 10),
+    (FAILURE_CAIDA_BAJA, 15),
+    (FAILURE_VALOR_CONSTANTE, 25),
+)
+
+# Fallos del tablero en vivo (y del benchmark, que mide el mismo motor): sin calendario, con
+# probabilidad por tick de cada tipo y de recuperarse. Con el calendario original (sin
+# recuperación) todos los sensores quedan en fallo desde el tick ~10. Así ~22% de las lecturas
+# son de fallo, en tramos de ~20 lecturas (el detector flatline necesita una ventana completa
+# de valores trabados para marcarlos).
+LIVE_FAILURE_SCHEDULE = None
+LIVE_FAILURE_PROBABILITIES = {FAILURE_PICO_ALTO: 0.006, FAILURE_CAIDA_BAJA: 0.004, FAILURE_VALOR_CONSTANTE: 0.003}
+LIVE_RECOVERY_PROBABILITY = 0.05
+
+
+def make_sensor_ids(sensor_count):
+    return [f"Sensor_{i:03d}" for i in range(1, sensor_count + 1)]
+
+
+def make_training_series(seed=42, size=500):
+    # Serie de entrenamiento original del tablero: lecturas normales con tramos de pico alto,
+    # caída baja y valor constante (mismo flujo de números que np.random.seed(seed)).
+    rng = np.random.RandomState(seed)
+    serie = np.clip(25 + 2 * rng.randn(size), 20, 30)
+    serie[50:55] = rng.uniform(45, 55, 5)
+    serie[120:125] = rng.uniform(5, 10, 5)
+    serie[200:205] = 23.0
+    serie[350:355] = rng.uniform(40, 50, 5)
+    return serie
+
+
+class FleetSimulator:
+    # Estado por sensor en arreglos NumPy; un tick genera las lecturas de toda la flota
+    # con operaciones vectorizadas. Los fallos se inyectan por calendario (periodos por
+    # tipo) y/o por probabilidad por tick, y se recuperan con recovery_probability.
+
+    def __init__(self, sensor_count, seed=42, failure_schedule=DEFAULT_FAILURE_SCHEDULE,
+                 failure_probabilities=None, recovery_probability=0.0,
+                 normal_mean=25.0, normal_std=2.0, normal_clip=(20.0, 30.0)):
+        if sensor_count <= 0:
+            raise ValueError("sensor_count debe ser mayor que cero")
+        self.sensor_count = int(sensor_count)
+        self.sensor_ids = make_sensor_ids(self.sensor_count)
+        self.failure_schedule = tuple(failure_schedule or ())
+        self.failure_probabilities = dict(failure_probabilities or {})
+        self.recovery_probability = float(recovery_probability)
+        self.normal_mean = normal_mean
+        self.normal_std = normal_std
+        self.normal_clip = normal_clip
+        self.rng = np.random.default_rng(seed)
+        self.tick_count = 0
+        self.failed = np.zeros(self.sensor_count, dtype=bool)
+        self.failure_type = np.zeros(self.sensor_count, dtype=np.int8)
+        self.persistence = np.zeros(self.sensor_count, dtype=np.int32)
+        self._sensor_index = np.arange(self.sensor_count)
+
+    def _inject_failures(self, i):
+        nuevo_tipo = np.zeros(self.sensor_count, dtype=np.int8)
+        for tipo, periodo in self.failure_schedule:
+            pendiente = nuevo_tipo == FAILURE_NONE
+            nuevo_tipo[pendiente & ((i + self._sensor_index) % periodo == 0)] = tipo
+        if self.failure_probabilities:
+            sorteo = self.rng.random(self.sensor_count)
+            acumulada = 0.0
+            for tipo, probabilidad in self.failure_probabilities.items():
+                elegido = (nuevo_tipo == FAILURE_NONE) & (sorteo >= acumulada) & (sorteo < acumulada + probabilidad)
+                nuevo_tipo[elegido] = tipo
+                acumulada += probabilidad
+        nuevo_tipo[self.failed] = FAILURE_NONE
+        return nuevo_tipo
+
+    def tick(self):
+        self.tick_count += 1
+        if self.recovery_probability > 0:
+            recuperado = self.failed & (self.rng.random(self.sensor_count) < self.recovery_probability)
+            self.failed[recuperado] = False
+            self.failure_type[recuperado] = FAILURE_NONE
+
+        persistente = self.failed.copy()
+        nuevo_tipo = self._inject_failures(self.tick_count)
+        nuevo = nuevo_tipo != FAILURE_NONE
+        self.failed |= nuevo
+        self.failure_type[nuevo] = nuevo_tipo[nuevo]
+        self.persistence[persistente] += 1
+        self.persistence[~persistente] = 0
+
+        u = self.rng.random(self.sensor_count)
+        normal = np.clip(self.normal_mean + self.normal_std * self.rng.standard_normal(self.sensor_count), *self.normal_clip)
+        rangos = FAILURE_VALUE_RANGES[self.failure_type]
+        fallo = rangos[:, 0] + (rangos[:, 1] - rangos[:, 0]) * u
+        values = np.where(self.failed, fallo, normal)
+
+        anomaly_codes = self.failure_type.copy()
+        anomaly_codes[persistente] += PERSISTENT_CODE_OFFSET
+        return values, anomaly_codes, self.failed.copy()
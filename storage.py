@@ -0,0 +1,388 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+READING_COLUMNS = ('timestamp', 'sensor', 'value', 'status', 'anomaly_type')
+READING_DTYPES = {
+    'timestamp': np.float64,
+    'sensor': np.int32,
+    'value': np.float64,
+    'status': np.int8,
+    'anomaly_type': np.int8,
+}
+
+
+def empty_columns(columns=READING_COLUMNS):
+    return {name: np.empty(0, dtype=READING_DTYPES[name]) for name in columns}
+
+
+def concat_columns(batches, columns=READING_COLUMNS):
+    if not batches:
+        return empty_columns(columns)
+    return {name: np.concatenate([batch[name] for batch in batches]).astype(READING_DTYPES[name], copy=False)
+            for name in columns}
+
+
+class SQLiteStorage:
+    # Una tabla de lecturas en modo WAL: las escrituras van por lotes en una transacción y
+    # cada hilo lector usa su propia conexión, así las consultas no bloquean al escritor.
+
+    def __init__(self, path):
+        self.path = path
+        directorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directorio, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            "timestamp REAL NOT NULL, sensor INTEGER NOT NULL, value REAL NOT NULL, "
+            "status INTEGER NOT NULL, anomaly_type INTEGER NOT NULL)"
+        )
+        # Las páginas se recorren por (timestamp, sensor): los índices dan ese orden sin ordenar
+        # en memoria, también filtrando por estado.
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_readings_sensor_time ON readings (sensor, timestamp)")
+        self._writer.execute("DROP INDEX IF EXISTS idx_readings_time")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_readings_time_sensor ON readings (timestamp, sensor)")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_readings_status_time ON readings (status, timestamp, sensor)")
+        # Conteo por (sensor, estado, tipo), actualizado en la misma transacción que cada lote.
+        nueva = self._writer.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'reading_counts'"
+        ).fetchone()[0] == 0
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS reading_counts (sensor INTEGER NOT NULL, status INTEGER NOT NULL, "
+            "anomaly_type INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (sensor, status, anomaly_type))"
+        )
+        if nueva:
+            self._writer.execute(
+                "INSERT INTO reading_counts SELECT sensor, status, anomaly_type, COUNT(*) FROM readings "
+                "GROUP BY sensor, status, anomaly_type"
+            )
+        self._writer.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def _reader(self):
+        conexion = getattr(self._local, 'connection', None)
+        if conexion is None:
+            conexion = self._connect()
+            self._local.connection = conexion
+        return conexion
+
+    def write(self, columns):
+        filas = zip(*(columns[name].tolist() for name in READING_COLUMNS))
+        claves, conteo = np.unique(np.stack([np.asarray(columns[name], dtype=np.int64)
+                                             for name in ('sensor', 'status', 'anomaly_type')]), axis=1, return_counts=True)
+        with self._write_lock:
+            with self._writer:
+                self._writer.executemany(
+                    "INSERT INTO readings (timestamp, sensor, value, status, anomaly_type) VALUES (?, ?, ?, ?, ?)", filas
+                )
+                self._writer.executemany(
+                    "INSERT INTO reading_counts VALUES (?, ?, ?, ?) ON CONFLICT (sensor, status, anomaly_type) "
+                    "DO UPDATE SET count = count + excluded.count",
+                    zip(*claves.tolist(), conteo.tolist()),
+                )
+
+    def _where(self, start=None, end=None, sensors=None, statuses=None, anomaly_types=None, before=None):
+        condiciones = []
+        parametros = []
+        if before is not None:
+            condiciones.append("(timestamp, sensor) < (?, ?)")
+            parametros.extend([float(before[0]), int(before[1])])
+        if start is not None:
+            condiciones.append("timestamp >= ?")
+            parametros.append(float(start))
+        if end is not None:
+            condiciones.append("timestamp <= ?")
+            parametros.append(float(end))
+        for nombre, permitidos in (('sensor', sensors), ('status', statuses), ('anomaly_type', anomaly_types)):
+            if permitidos is not None:
+                permitidos = [int(valor) for valor in permitidos]
+                condiciones.append(f"{nombre} IN ({', '.join('?' * len(permitidos))})" if permitidos else "0")
+                parametros.extend(permitidos)
+        return (" WHERE " + " AND ".join(condiciones)) if condiciones else "", parametros
+
+    def query(self, start=None, end=None, sensors=None, statuses=None, anomaly_types=None,
+              columns=READING_COLUMNS, limit=None, offset=0, newest_first=False, before=None):
+        # before=(timestamp, sensor) deja solo las lecturas anteriores a esa clave (paginado
+        # por clave en lugar de saltar `offset` filas).
+        where, parametros = self._where(start, end, sensors, statuses, anomaly_types, before)
+        direccion = 'DESC' if newest_first else 'ASC'
+        sql = f"SELECT {', '.join(columns)} FROM readings{where} ORDER BY timestamp {direccion}, sensor {direccion}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            parametros = parametros + [int(limit), int(offset)]
+        filas = self._reader().execute(sql, parametros).fetchall()
+        if not filas:
+            return empty_columns(columns)
+        return {name: np.fromiter((fila[i] for fila in filas), dtype=READING_DTYPES[name], count=len(filas))
+                for i, name in enumerate(columns)}
+
+    def count(self, start=None, end=None, sensors=None, statuses=None, anomaly_types=None):
+        where, parametros = self._where(start, end, sensors, statuses, anomaly_types)
+        return self._reader().execute(f"SELECT COUNT(*) FROM readings{where}", parametros).fetchone()[0]
+
+    def count_by_code(self):
+        # Lecturas guardadas por (sensor, estado, tipo de anomalía); el motor parte de aquí y
+        # lleva los conteos por filtro sin volver a contar en disco.
+        filas = self._reader().execute("SELECT sensor, status, anomaly_type, count FROM reading_counts").fetchall()
+        return {name: np.array([fila[i] for fila in filas], dtype=np.int64)
+                for i, name in enumerate(('sensor', 'status', 'anomaly_type', 'count'))}
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+
+
+class ParquetStorage:
+    # Archivos Parquet particionados por sensor y día (sensor=<idx>/day=<AAAA-MM-DD>/).
+    # Las escrituras se acumulan en memoria y se vuelcan en row groups grandes (cada
+    # row_group_rows filas o max_buffer_seconds), y los días ya cerrados se compactan a un
+    # archivo por partición. Las consultas podan particiones por sensor/día, leen solo las
+    # columnas pedidas y ven también las lecturas aún acumuladas.
+
+    def __init__(self, root, row_group_rows=200_000, max_buffer_seconds=300.0):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("ParquetStorage requiere pyarrow (pip install pyarrow)") from e
+        self.root = root
+        self.row_group_rows = row_group_rows
+        self.max_buffer_seconds = max_buffer_seconds
+        os.makedirs(root, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._batch = 0
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_since = None
+        self._cached_dataset = None
+        self._compacted = set()
+
+    def write(self, columns):
+        with self._write_lock:
+            self._buffer.append({name: np.asarray(columns[name]) for name in READING_COLUMNS})
+            self._buffer_rows += len(columns['timestamp'])
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+            if (self._buffer_rows >= self.row_group_rows
+                    or time.monotonic() - self._buffer_since >= self.max_buffer_seconds):
+                try:
+                    ultimo_dia = self._write_buffer()
+                except Exception:
+                    # El lote actual vuelve a la cola del StorageWriter; los anteriores siguen acumulados.
+                    self._buffer.pop()
+                    self._buffer_rows -= len(columns['timestamp'])
+                    raise
+                try:
+                    self._compact(before_day=ultimo_dia)
+                except Exception:
+                    # Compactar es opcional: la partición queda como estaba y se reintenta después.
+                    pass
+
+    def _write_buffer(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return None
+        columns = concat_columns(self._buffer)
+        dias = (columns['timestamp'] // 86400).astype(np.int64).astype('datetime64[D]').astype(str)
+        tabla = pa.table({name: columns[name] for name in READING_COLUMNS} | {'day': dias})
+        self._batch += 1
+        pq.write_to_dataset(
+            tabla, self.root, partition_cols=['sensor', 'day'],
+            basename_template=f"part-{time.time_ns()}-{self._batch}-{{i}}.parquet",
+        )
+        self._buffer, self._buffer_rows, self._buffer_since = [], 0, None
+        self._cached_dataset = None
+        # Una partición ya compactada que recibe lecturas atrasadas se vuelve a compactar.
+        self._compacted -= {(f"sensor={sensor}", f"day={dia}") for sensor, dia in zip(columns['sensor'].tolist(), dias.tolist())}
+        return _day(columns['timestamp'].max())
+
+    def _compact(self, before_day):
+        # Junta en un solo archivo las particiones de días anteriores a before_day (ya no
+        # reciben lecturas nuevas del flujo en vivo).
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for entrada_sensor in os.scandir(self.root):
+            if not entrada_sensor.is_dir():
+                continue
+            for entrada_dia in os.scandir(entrada_sensor.path):
+                dia = entrada_dia.name.partition('=')[2]
+                clave = (entrada_sensor.name, entrada_dia.name)
+                if not entrada_dia.is_dir() or dia >= before_day or clave in self._compacted:
+                    continue
+                archivos = sorted(entrada.path for entrada in os.scandir(entrada_dia.path) if entrada.name.endswith('.parquet'))
+                if len(archivos) > 1:
+                    tabla = pa.concat_tables([pq.ParquetFile(archivo).read() for archivo in archivos])
+                    pq.write_table(tabla, os.path.join(entrada_dia.path, f"compact-{time.time_ns()}.parquet"))
+                    for archivo in archivos:
+                        os.remove(archivo)
+                    self._cached_dataset = None
+                self._compacted.add(clave)
+
+    def _dataset(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        if self._cached_dataset is None:
+            esquema_particion = ds.partitioning(pa.schema([('sensor', pa.int32()), ('day', pa.string())]), flavor='hive')
+            self._cached_dataset = ds.dataset(self.root, format='parquet', partitioning=esquema_particion)
+        return self._cached_dataset
+
+    def query(self, start=None, end=None, sensors=None, statuses=None, anomaly_types=None,
+              columns=READING_COLUMNS, limit=None, offset=0, newest_first=False, before=None):
+        import pyarrow.dataset as ds
+
+        condiciones = []
+        if start is not None:
+            condiciones.append(ds.field('timestamp') >= float(start))
+            condiciones.append(ds.field('day') >= _day(start))
+        if end is not None:
+            condiciones.append(ds.field('timestamp') <= float(end))
+            condiciones.append(ds.field('day') <= _day(end))
+        if before is not None:
+            condiciones.append((ds.field('timestamp') < float(before[0]))
+                               | ((ds.field('timestamp') == float(before[0])) & (ds.field('sensor') < int(before[1]))))
+            condiciones.append(ds.field('day') <= _day(before[0]))
+        for nombre, permitidos in (('sensor', sensors), ('status', statuses), ('anomaly_type', anomaly_types)):
+            if permitidos is not None:
+                condiciones.append(ds.field(nombre).isin([int(valor) for valor in permitidos]))
+        filtro = None
+        for condicion in condiciones:
+            filtro = condicion if filtro is None else filtro & condicion
+        leidas = tuple(dict.fromkeys(('timestamp', 'sensor') + tuple(columns)))
+        with self._write_lock:
+            acumuladas = concat_columns(self._buffer)
+            if any(entry.is_dir() for entry in os.scandir(self.root)):
+                tabla = self._dataset().to_table(columns=list(leidas), filter=filtro)
+                guardadas = {name: tabla.column(name).to_numpy().astype(READING_DTYPES[name], copy=False) for name in leidas}
+            else:
+                guardadas = empty_columns(leidas)
+        mascara = _mask(acumuladas, start, end, sensors, statuses, anomaly_types, before)
+        acumuladas = {name: acumuladas[name][mascara] for name in leidas}
+        resultado = {name: np.concatenate([guardadas[name], acumuladas[name]]) for name in leidas}
+        orden = np.lexsort((resultado['sensor'], resultado['timestamp']))
+        if newest_first:
+            orden = orden[::-1]
+        if limit is not None:
+            orden = orden[offset:offset + limit]
+        return {name: resultado[name][orden] for name in columns}
+
+    def count(self, start=None, end=None, sensors=None, statuses=None, anomaly_types=None):
+        return len(self.query(start, end, sensors, statuses, anomaly_types, columns=('timestamp',))['timestamp'])
+
+    def count_by_code(self):
+        columnas = self.query(columns=('sensor', 'status', 'anomaly_type'))
+        claves, conteo = np.unique(np.stack([columnas['sensor'], columnas['status'], columnas['anomaly_type']]),
+                                   axis=1, return_counts=True)
+        return {'sensor': claves[0].astype(np.int64), 'status': claves[1].astype(np.int64),
+                'anomaly_type': claves[2].astype(np.int64), 'count': conteo.astype(np.int64)}
+
+    def close(self):
+        with self._write_lock:
+            self._write_buffer()
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(float(timestamp), tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def _mask(columns, start=None, end=None, sensors=None, statuses=None, anomaly_types=None, before=None):
+    # Mismo filtro que las consultas a disco, sobre columnas en memoria.
+    timestamps = columns['timestamp']
+    mascara = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        mascara &= timestamps >= start
+    if end is not None:
+        mascara &= timestamps <= end
+    if before is not None:
+        mascara &= (timestamps < before[0]) | ((timestamps == before[0]) & (columns['sensor'] < before[1]))
+    for nombre, permitidos in (('sensor', sensors), ('status', statuses), ('anomaly_type', anomaly_types)):
+        if permitidos is not None:
+            mascara &= np.isin(columns[nombre], np.asarray(permitidos))
+    return mascara
+
+
+def open_storage(backend, path):
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+    if backend == "parquet":
+        return ParquetStorage(path)
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+
+
+class StorageWriter:
+    # Acumula las lecturas del ciclo de ingesta en memoria y las escribe por lotes desde
+    # un hilo propio (cada batch_size filas o flush_interval segundos).
+
+    def __init__(self, storage, batch_size=5000, flush_interval=2.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.rows_written = 0
+        self.flushes = 0
+        self.last_error = ""
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def submit(self, columns):
+        with self._lock:
+            self._pending.append({name: np.array(columns[name], copy=True) for name in READING_COLUMNS})
+            self._pending_rows += len(columns['timestamp'])
+            lleno = self._pending_rows >= self.batch_size
+        if lleno:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pendientes, self._pending, self._pending_rows = self._pending, [], 0
+            if not pendientes:
+                return 0
+            lote = concat_columns(pendientes)
+            try:
+                self.storage.write(lote)
+            except Exception as e:
+                self.last_error = str(e)
+                with self._lock:
+                    self._pending[:0] = pendientes
+                    self._pending_rows += len(lote['timestamp'])
+                return 0
+            self.rows_written += len(lote['timestamp'])
+            self.flushes += 1
+            return len(lote['timestamp'])
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from backtest import replay
+
+
+def test_iso_and_epoch_timestamps_replay_the_same(tmp_path):
+    rng = np.random.default_rng(0)
+    ticks = 600
+    epoch = 1_700_000_000 + np.repeat(np.arange(ticks), 2).astype(np.float64)
+    valores = 25 + 2 * rng.standard_normal(2 * ticks)
+    valores[200:260] = 50.0
+    lecturas = pd.DataFrame({'timestamp': epoch, 'sensor': np.tile([0, 1], ticks), 'value': valores})
+    numerico = tmp_path / "epoch.csv"
+    iso = tmp_path / "iso.csv"
+    lecturas.to_csv(numerico, index=False)
+    lecturas.assign(timestamp=pd.to_datetime(epoch, unit='s', utc=True).strftime('%Y-%m-%dT%H:%M:%SZ')).to_csv(iso, index=False)
+
+    a = replay(str(numerico), chunk_size=250)
+    b = replay(str(iso), chunk_size=250)
+    assert a['incident_events'] == b['incident_events']
+    assert a['per_sensor'] == b['per_sensor']
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+
+from engine import SensorEngine
+from model_registry import ModelRegistry
+from rollups import RollupStore
+from simulation import make_training_series
+from storage import SQLiteStorage, StorageWriter
+from training import fit_sensor_model
+
+
+def test_mixed_fleet_starts_with_configured_contamination(tmp_path):
+    registro = ModelRegistry(str(tmp_path))
+    serie = make_training_series()
+    registro.save("A", fit_sensor_model(serie, contamination=0.03), serie, window=500, feature_window=None)
+    registro.save("B", fit_sensor_model(serie, contamination=0.08), serie, window=500, feature_window=None)
+    compartido = fit_sensor_model(serie, contamination=0.03)
+    sensor_ids = ["A", "B", "C"]
+    modelos = {sensor_id: compartido for sensor_id in sensor_ids} | registro.load_fleet(sensor_ids)
+
+    engine = SensorEngine(None, modelos, sensor_ids=sensor_ids, contamination=0.05)
+
+    assert {model.contamination for model in engine.sensor_models.values()} == {0.05}
+    assert engine.contamination == 0.05
+    lecturas = np.linspace(15, 40, 200)
+    for idx, sensor_id in enumerate(sensor_ids):
+        esperadas = engine.sensor_models[sensor_id].predict(lecturas.reshape(-1, 1))
+        assert np.array_equal(engine.scorer.predict_readings(np.full(200, idx), lecturas), esperadas)
+
+
+def test_short_window_reads_raw_ring_with_storage_attached(tmp_path):
+    sensor_ids = ["A", "B"]
+    modelo = fit_sensor_model(make_training_series(), contamination=0.03)
+    anterior = SQLiteStorage(str(tmp_path / "lecturas.db"))
+    ahora = time.time()
+    # Lecturas de una corrida anterior, fuera de la ventana de 5 minutos.
+    anterior.write({'timestamp': np.full(2, ahora - 3600.0), 'sensor': np.arange(2), 'value': np.full(2, 20.0),
+                    'status': np.zeros(2, dtype=np.int8), 'anomaly_type': np.zeros(2, dtype=np.int8)})
+    anterior.close()
+    writer = StorageWriter(SQLiteStorage(str(tmp_path / "lecturas.db")))
+    engine = SensorEngine(None, {sensor_id: modelo for sensor_id in sensor_ids}, sensor_ids=sensor_ids,
+                          storage_writer=writer, rollups=RollupStore(len(sensor_ids)))
+    engine.backfill_rollups(ahora - 60.0)
+    for segundo in range(16):
+        engine.process_readings(np.arange(2), ahora - 60.0 + segundo, np.full(2, 21.0))
+
+    assert engine.rollup_window(300, 200) is None
+    assert len(engine.history_window(seconds=300)['value']) == 32
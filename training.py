@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from features import window_features
+
+
+def fit_sensor_model(values, contamination=0.03, random_state=42, feature_window=None, n_estimators=100):
+    # Función de módulo (no lambda ni método) para que el pool de procesos pueda enviarla.
+    from models import RetunableIsolationForest
+
+    values = np.asarray(values, dtype=np.float64)
+    datos = window_features(values, feature_window) if feature_window else values.reshape(-1, 1)
+    model = RetunableIsolationForest(contamination=contamination, random_state=random_state, n_estimators=n_estimators)
+    return model.fit(datos)
+
+
+def _pool_context():
+    # El proceso tiene hilos corriendo (motor, alertas, ingesta): fork podría copiar un lock
+    # tomado. forkserver arranca los trabajadores desde un proceso limpio.
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+
+def make_training_pool(max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=_pool_context())
+
+
+def train_sensor_models(series, pool=None, max_workers=None, **params):
+    # series: sensor_id -> lecturas de ese sensor. Cada modelo se ajusta en un proceso
+    # del pool (uno por núcleo), así el costo crece con los núcleos y no con un solo hilo.
+    sensor_ids = list(series)
+    if not sensor_ids:
+        return {}
+    entrenar = partial(fit_sensor_model, **params)
+    if pool is None and (max_workers == 1 or len(sensor_ids) == 1):
+        return {sensor_id: entrenar(series[sensor_id]) for sensor_id in sensor_ids}
+    propio = pool is None
+    pool = make_training_pool(max_workers) if propio else pool
+    try:
+        trabajadores = getattr(pool, '_max_workers', 1)
+        lote = max(1, len(sensor_ids) // (4 * trabajadores))
+        modelos = list(pool.map(entrenar, [series[sensor_id] for sensor_id in sensor_ids], chunksize=lote))
+    finally:
+        if propio:
+            pool.shutdown()
+    return dict(zip(sensor_ids, modelos))
+
+
+class ModelRetrainer:
+    # Reentrena en segundo plano un modelo por sensor con su propia ventana reciente del
+    # historial y lo intercambia en el motor de forma atómica (engine.swap_models). La
+    # ingesta sigue corriendo mientras se entrena; solo el intercambio toma el lock. El pool
+    # de procesos vive solo durante cada ronda (a lo sumo un trabajador por sensor), así no
+    # quedan procesos ociosos entre reentrenamientos.
+
+    def __init__(self, engine, interval=300.0, window=2000, min_samples=200, exclude_anomalies=True,
+                 max_workers=None, random_state=42, n_estimators=100, registry=None):
+        self.engine = engine
+        self.interval = interval
+        self.window = window
+        self.min_samples = min_samples
+        self.exclude_anomalies = exclude_anomalies
+        self.max_workers = max_workers
+        self.random_state = random_state
+        self.n_estimators = n_estimators
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+        self.retrains = 0
+        self.models_swapped = 0
+        self.last_duration_s = 0.0
+        self.last_retrain_at = None
+        self.last_error = ""
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-retrainer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=30.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def retrain_now(self):
+        inicio = time.monotonic()
+        series = self.engine.sensor_windows(self.window, exclude_anomalies=self.exclude_anomalies)
+        series = {sensor_id: valores for sensor_id, valores in series.items()
+                  if len(valores) >= self.min_samples
+                  and not (self.registry is not None and self.registry.is_pinned(sensor_id))}
+        if not series:
+            return 0
+        trabajadores = min(self.max_workers or os.cpu_count(), len(series))
+        modelos = train_sensor_models(
+            series, max_workers=trabajadores, contamination=self.engine.contamination,
+            random_state=self.random_state, feature_window=self.engine.feature_window,
+            n_estimators=self.n_estimators,
+        )
+        if self.registry is not None:
+            # Se publica cada versión en el registro y se intercambian las copias mapeadas
+            # desde disco: los bosques completos recién entrenados no quedan en memoria.
+            for sensor_id, model in modelos.items():
+                self.registry.save(sensor_id, model, series[sensor_id], window=self.window,
+                                   feature_window=self.engine.feature_window)
+            modelos = self.registry.load_fleet(list(modelos))
+        self.engine.swap_models(modelos)
+        self.retrains += 1
+        self.models_swapped += len(modelos)
+        self.last_duration_s = time.monotonic() - inicio
+        self.last_retrain_at = time.time()
+        return len(modelos)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.retrain_now()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def metrics(self):
+        return {
+            'retrains': self.retrains,
+            'models_swapped': self.models_swapped,
+            'last_duration_s': self.last_duration_s,
+            'last_retrain_at': self.last_retrain_at,
+            'last_error': self.last_error,
+        }